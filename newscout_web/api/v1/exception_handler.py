@@ -5,6 +5,16 @@ from collections import OrderedDict
 from django.utils.translation import ugettext_lazy as _
 
 
+def create_response(response_data):
+    """
+    method used to create response data in given format
+    """
+    response = OrderedDict()
+    response["header"] = {"status": "1"}
+    response["body"] = response_data
+    return response
+
+
 def create_error_response(response_data):
     """
     method used to create response data in given format
@@ -2,11 +2,12 @@ from rest_framework import serializers
 from core.models import (Category, Article, BaseUserProfile, Source, BookmarkArticle,
                               ArtilcleLike, HashTag, ArticleMedia, Menu, SubMenu,
                               Devices, Notification,TrendingArticle, Advertisement,
-                              Campaign, AdGroup, AdType)
+                              Campaign, AdGroup, AdType, HashTagDailyCount)
 from django.contrib.auth import authenticate
 from rest_framework import exceptions
 from rest_framework.validators import UniqueValidator
 from rest_framework.authtoken.models import Token
+from core.resolvers import hashtag_resolver
 try:
     from urllib import urlencode, quote
 except:
@@ -60,7 +61,7 @@ class ArticleSerializer(serializers.ModelSerializer):
             self.fields["hash_tags"] = serializers.SerializerMethodField()
 
     def get_hash_tags(self, instance):
-        return list(instance.hash_tags.all().values_list("name", flat=True))
+        return [hash_tag.name for hash_tag in instance.hash_tags.all()]
 
 
 class UserSerializer(serializers.Serializer):
@@ -187,8 +188,9 @@ class ArticleCreateUpdateSerializer(serializers.ModelSerializer):
         article = Article.objects.create(**validated_data)
 
         if hash_tags:
-            hash_tags = [HashTag.objects.get_or_create(name=name)[0] for name in hash_tags]
+            hash_tags = hashtag_resolver.get_or_create_many(hash_tags).values()
             article.hash_tags.add(*hash_tags)
+            HashTagDailyCount.increment((hash_tag, article.published_on) for hash_tag in hash_tags)
             article.save()
 
         if article_media:
@@ -217,7 +219,7 @@ class ArticleCreateUpdateSerializer(serializers.ModelSerializer):
         instance.save()
 
         if hash_tags:
-            hash_tags = [HashTag.objects.get_or_create(name=name)[0] for name in hash_tags]
+            hash_tags = hashtag_resolver.get_or_create_many(hash_tags).values()
             instance.hash_tags.clear()
             instance.hash_tags.add(*hash_tags)
             instance.save()
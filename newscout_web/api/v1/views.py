@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
-from django.http import Http404
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
 
 from core.models import (Category, Article, Source, BaseUserProfile,
                               BookmarkArticle, ArtilcleLike, HashTag, Menu, Notification, Devices,
-                              SocialAccount, Category, CategoryAssociation,
-                              TrendingArticle, Domain, Advertisement, DailyDigest,
-                              Campaign, AdGroup, AdType)
+                              SocialAccount, Category,
+                              Domain, Advertisement, DailyDigest,
+                              Campaign, AdGroup, AdType, RelatedArticle, HashTagDailyCount)
 
 from rest_framework.authtoken.models import Token
 
@@ -15,7 +16,7 @@ from rest_framework.views import APIView
 from .serializers import (CategorySerializer, ArticleSerializer, UserSerializer,
                           SourceSerializer, LoginUserSerializer, BaseUserProfileSerializer,
                           BookmarkArticleSerializer, ArtilcleLikeSerializer, HashTagSerializer,
-                          MenuSerializer, NotificationSerializer, TrendingArticleSerializer,
+                          MenuSerializer, NotificationSerializer,
                           ArticleCreateUpdateSerializer, AdvertisementSerializer,
                           CampaignSerializer, AdGroupSerializer, AdSerializer,
                           AdCreateSerializer, GetAdGroupSerializer, AdTypeSerializer, GetAdSerializer)
@@ -36,17 +37,27 @@ from rest_framework.parsers import JSONParser
 from django.core.mail import EmailMultiAlternatives
 from django.conf import settings
 from datetime import datetime, timedelta
-from django.db.models import Count
 import pytz
 import uuid
-from core.utils import es, ingest_to_elastic, delete_from_elastic
-from elasticsearch_dsl import Search
+from core.utils import es, es_executor, ingest_to_elastic, delete_from_elastic, get_doc_id
+from core.cache import recommendation_cache, search_cache, facets_cache
+from core.categories import get_category_hierarchy
+from core.heavy_hitters import get_top_hash_tags
+from redis import RedisError
+from core.trending import get_trending_data, get_trending_payload
+from elasticsearch_dsl import Search, MultiSearch
+from elasticsearch.exceptions import NotFoundError, ElasticsearchException
 import math
+import json
+from functools import partial
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import base64
+import binascii
 from rest_framework.utils.urls import replace_query_param
 from google.auth.transport import requests as grequests
 from google.oauth2 import id_token
 import facebook
-from .exception_handler import (create_error_response,TokenIDMissing, ProviderMissing,
+from .exception_handler import (create_response, create_error_response,TokenIDMissing, ProviderMissing,
                                 SocialAuthTokenException, CampaignNotFoundException,
                                 AdGroupNotFoundException, AdvertisementNotFoundException)
 import random
@@ -54,16 +65,6 @@ import logging
 log = logging.getLogger(__name__)
 
 
-def create_response(response_data):
-    """
-    method used to create response data in given format
-    """
-    response = OrderedDict()
-    response["header"] = {"status": "1"}
-    response["body"] = response_data
-    return response
-
-
 def create_serializer_error_response(errors):
     """
     methos is used to create error response for serializer errors
@@ -354,22 +355,86 @@ class ArticleBookMarkAPIView(APIView):
 class ArticleRecommendationsAPIView(APIView):
     permission_classes = (AllowAny,)
 
-    def format_response(self, response):
-        results = []
-        if response['hits']['hits']:
-            for result in response['hits']['hits']:
-                results.append(result["_source"])
+    def get_recommendations(self, article_id):
+        """
+        this method returns recommended articles from elastic search or None
+        when recommendations are not generated for the article
+        """
+        try:
+            document = es.get(index='recommendation', doc_type='recommendation', id=get_doc_id(article_id))
+        except NotFoundError:
+            return None
+        ids = document['_source']['recommendation'][:25]
+        if not ids:
+            return []
+        response = es.mget(index='article', doc_type='article', body={"ids": [get_doc_id(item) for item in ids]})
+        return [doc['_source'] for doc in response['docs'] if doc.get('found')]
+
+    def get_related_articles(self, article_id):
+        """
+        this method returns recommended articles stored in RelatedArticle
+        or None when recommendations are not stored for the article
+        """
+        related = RelatedArticle.objects.filter(source_id=article_id).order_by("-score").select_related(
+            "related__source", "related__category", "related__domain").prefetch_related(
+            "related__articlemedia_set", "related__hash_tags")[:25]
+        articles = [current.related for current in related]
+        if not articles:
+            return None
+        return ArticleSerializer(articles, many=True, context={"hash_tags_list": True}).data
+
+    def cache_recommendations(self, article_id, future):
+        if not future.exception() and future.result() is not None:
+            recommendation_cache.set(article_id, future.result())
+
+    def get_hedged_recommendations(self, article_id):
+        """
+        this method returns recommendations from elastic search, or from
+        database when elastic search fails, has no recommendations of the
+        article or does not answer in time and database has them
+        """
+        future = es_executor.submit(self.get_recommendations, article_id)
+        try:
+            results = future.result(timeout=settings.ES_HEDGE_TIMEOUT)
+        except FutureTimeoutError:
+            results = self.get_related_articles(article_id)
+            if results is not None:
+                # elastic search is slow, answer from database now and
+                # cache recommendations once the lookup is done
+                future.add_done_callback(partial(self.cache_recommendations, article_id))
+                return results
+            # nothing in database, wait for elastic search upto its timeout
+            try:
+                results = future.result(timeout=settings.ELASTICSEARCH["timeout"])
+            except (FutureTimeoutError, ElasticsearchException) as e:
+                log.exception(e)
+                return None
+        except ElasticsearchException as e:
+            log.exception(e)
+            results = self.get_related_articles(article_id)
+        else:
+            if results is None:
+                # recommendation missing from elastic search, for example
+                # while its index is rebuilt
+                results = self.get_related_articles(article_id)
+        if results is not None:
+            recommendation_cache.set(article_id, results)
         return results
 
     def get(self, request, *args, **kwargs):
         article_id = self.kwargs.get("article_id", "")
         if article_id:
-            results = es.search(index='recommendation',body={"query":{"match": {"id": int(article_id)}}})
-            if results['hits']['hits']:
-                recommendation = results['hits']['hits'][0]['_source']['recommendation']
-                search_results = es.search(index='article',body={"query":{"terms": {"id": recommendation}},"size": 25})
+            article_id = int(article_id)
+            results = recommendation_cache.get(article_id)
+            if results is None and settings.RECOMMENDATION_BACKEND == "database":
+                results = self.get_related_articles(article_id)
+                if results is not None:
+                    recommendation_cache.set(article_id, results)
+            elif results is None:
+                results = self.get_hedged_recommendations(article_id)
+            if results is not None:
                 return Response(create_response({
-                    "results": self.format_response(search_results)
+                    "results": results
                 }))
 
         return Response(create_error_response({
@@ -506,36 +571,26 @@ class HashTagAPIView(ListAPIView):
     def get_queryset(self):
         weekly = self.request.GET.get("weekly","")
         monthly = self.request.GET.get("monthly","")
+        hours = self.request.GET.get("hours","")
+        if hours:
+            try:
+                return get_top_hash_tags(int(hours))
+            except RedisError as e:
+                log.exception(e)
         end = datetime.utcnow()
         pst = pytz.timezone('Asia/Kolkata')
         end = pst.localize(end)
         utc = pytz.UTC
         end = end.astimezone(utc)
-        articles = Article.objects.all()
-        queryset = HashTag.objects.all()
-
+        start = end - timedelta(days=1)
         if weekly:
-            weekly = int(weekly)
-            start = end - timedelta(days=7*weekly)
-            hash_tags = articles.filter(published_on__range=(start,end)).values('hash_tags__name').annotate(count=Count('hash_tags')).order_by('-count')[:10]
-            for hashtag in hash_tags:
-                hashtag['name'] = hashtag.pop('hash_tags__name')
-            queryset = hash_tags
-
+            start = end - timedelta(days=7*int(weekly))
         if monthly:
-            monthly = int(monthly)
-            start = end - timedelta(days=30*monthly)
-            hash_tags = articles.filter(published_on__range=(start,end)).values('hash_tags__name').annotate(count=Count('hash_tags')).order_by('-count')[:10]  
-            for hashtag in hash_tags:
-                hashtag['name'] = hashtag.pop('hash_tags__name')
-            queryset = hash_tags
-
-        if not weekly and not monthly:
-            start = end - timedelta(days=1)
-            hash_tags = articles.filter(published_on__range=(start,end)).values('hash_tags__name').annotate(count=Count('hash_tags')).order_by('-count')[:10]
-            for hashtag in hash_tags:
-                hashtag['name'] = hashtag.pop('hash_tags__name')
-            queryset = hash_tags
+            start = end - timedelta(days=30*int(monthly))
+
+        # counts are stored per utc day, so the window covers whole days
+        queryset = HashTagDailyCount.get_top(
+            HashTagDailyCount.get_date(start), HashTagDailyCount.get_date(end))
 
         return queryset
 
@@ -557,66 +612,97 @@ class HashTagAPIView(ListAPIView):
 
 class ArticleSearchAPI(APIView):
     """
-    this view is used for article search and filter
+    this view is used for article search and filter, pages are selected
+    with page and rows or, when cursor parameter is given, with search_after
+    using cursor returned in next link, facets=0 skips facet aggregations
     """
     permission_classes = (AllowAny,)
+    FILTERS = ("query", "source", "category", "domain", "tags")
 
-    def format_response(self, response):
-        results = []
-        filters = {}
-        if response.hits.hits:
-            for result in response.hits.hits:
-                results.append(result["_source"])
-
-            if response.aggregations.category.buckets:
-                filters["category"] = response.aggregations.category.buckets._l_
-
-            if response.aggregations.source.buckets:
-                filters["source"] = response.aggregations.source.buckets._l_
+    def encode_cursor(self, values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
 
-            if response.aggregations.hash_tags.buckets:
-                filters["hash_tags"] = response.aggregations.hash_tags.buckets._l_
-        return results, filters
+    def decode_cursor(self, cursor):
+        """
+        this method returns sort values encoded in cursor, None when cursor
+        is not valid
+        """
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        except (ValueError, TypeError, binascii.Error):
+            return None
+        if not isinstance(values, list) or len(values) != 3:
+            return None
+        for value in values:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return None
+        return values
+
+    def format_hits(self, response, size):
+        """
+        this method returns results, count and cursor of the next page
+        """
+        results = []
+        for result in response.hits.hits:
+            results.append(result["_source"])
 
-    def get(self, request):
-        page = self.request.GET.get("page", "1")
+        next_cursor = None
+        if len(response.hits.hits) == size:
+            next_cursor = self.encode_cursor(list(response.hits.hits[-1]["sort"]))
+        return results, response["hits"]["total"], next_cursor
 
-        if page.isdigit():
-            page = int(page)
-        else:
-            page = 1
+    def format_facets(self, response):
+        filters = {}
+        if response.aggregations.category.buckets:
+            filters["category"] = response.aggregations.category.buckets._l_
 
-        size = self.request.GET.get("rows", "20")
-        if size.isdigit():
-            size = int(size)
-        else:
-            size = 20
+        if response.aggregations.source.buckets:
+            filters["source"] = response.aggregations.source.buckets._l_
 
-        query = self.request.GET.get("q", "")
-        source = self.request.GET.getlist("source", [])
-        category = self.request.GET.getlist("category", [])
-        domain = self.request.GET.getlist("domain", [])
-        tags = self.request.GET.getlist("tag", [])
-        sort = self.request.GET.get("sort", "desc")
+        if response.aggregations.hash_tags.buckets:
+            filters["hash_tags"] = response.aggregations.hash_tags.buckets._l_
+        return filters
 
-        if not domain:
-            return Response(create_serializer_error_response({"domain": ["Domain id is required"]}))
+    def get_params(self, request):
+        """
+        this method returns normalised search parameters, equal searches
+        get equal parameters so they share cache entry
+        """
+        page = request.GET.get("page", "1")
+        page = int(page) if page.isdigit() else 1
+        size = request.GET.get("rows", "20")
+        size = int(size) if size.isdigit() else 20
+        sort = request.GET.get("sort", "desc")
+
+        return {
+            "cursor": request.GET.get("cursor"),
+            "facets": request.GET.get("facets", "1") != "0",
+            "query": request.GET.get("q", "").strip().lower(),
+            "source": sorted(set(s.lower() for s in request.GET.getlist("source", []))),
+            "category": sorted(set(request.GET.getlist("category", []))),
+            "domain": sorted(set(request.GET.getlist("domain", []))),
+            "tags": sorted(set(tag.lower().replace("-", " ") for tag in request.GET.getlist("tag", []))),
+            "sort": sort,
+            "page": page,
+            "size": size,
+        }
 
+    def get_search(self, params):
+        """
+        this method returns search with query and filters of params
+        """
         sr = Search(using=es, index="article")
 
         # generate elastic search query
         must_query = {}
         should_query = []
 
-        if query:
-            query = query.lower()
-            must_query = {"multi_match": {"query": query,"fields": ["title", "blurb"]}}
+        if params["query"]:
+            must_query = {"multi_match": {"query": params["query"],"fields": ["title", "blurb"]}}
 
-        if tags:
-            tags = [tag.lower().replace("-", " ") for tag in tags]
-            for tag in tags:
-                sq = {"match_phrase": {"hash_tags" : tag}}
-                should_query.append(sq)
+        for tag in params["tags"]:
+            sq = {"match_phrase": {"hash_tags" : tag}}
+            should_query.append(sq)
 
         if must_query:
             sr = sr.query("bool", must=must_query)
@@ -627,46 +713,114 @@ class ArticleSearchAPI(APIView):
             else:
                 sr = sr.filter("bool", should=should_query[0])
 
-        if domain:
-            sr = sr.filter("terms", domain=list(domain))
+        if params["domain"]:
+            sr = sr.filter("terms", domain=params["domain"])
 
-        if category:
-            cat_objs = Category.objects.filter(id__in=category)
-            category = cat_objs.values_list("id", flat=True)
-            cat_assn_objs = CategoryAssociation.objects.filter(parent_cat__in=cat_objs).values_list("child_cat__id", flat=True)
-            if cat_assn_objs:
-                new_category = set(list(cat_assn_objs) + list(category))
-                sr = sr.filter("terms", category_id=list(new_category))
-            else:
-                if category:
-                    sr = sr.filter("terms", category_id=list(category))
+        if params["category"]:
+            category = get_category_hierarchy().expand(params["category"])
+            if category:
+                sr = sr.filter("terms", category_id=sorted(category))
 
-        if source:
-            source = [s.lower() for s in source]
-            sr = sr.filter("terms", source=source)
+        if params["source"]:
+            sr = sr.filter("terms", source=params["source"])
+
+        return sr
 
-        sr = sr.sort({"article_score" : {"order" : sort}})
-        sr = sr.sort({"published_on" : {"order" : sort}})
+    def get_hits_search(self, params):
+        """
+        this method returns search for the requested page of results
+        """
+        sr = self.get_search(params)
+
+        # id breaks ties so that every article has a unique position
+        sr = sr.sort(
+            {"article_score" : {"order" : params["sort"]}},
+            {"published_on" : {"order" : params["sort"]}},
+            {"id" : {"order" : params["sort"]}})
 
         # pagination
-        start = (page - 1) * size
-        end = start + size
-        sr = sr[start:end]
+        if params["cursor"] is not None:
+            sr = sr.extra(size=params["size"])
+            if params["cursor"]:
+                sr = sr.extra(search_after=self.decode_cursor(params["cursor"]))
+        else:
+            start = (params["page"] - 1) * params["size"]
+            end = start + params["size"]
+            sr = sr[start:end]
 
-        #generate facets
+        return sr
+
+    def get_facets_search(self, params):
+        """
+        this method returns search for facets, which depend only on filters
+        """
+        sr = self.get_search(params).extra(size=0)
         sr.aggs.bucket("category", "terms", field="category.keyword")
         sr.aggs.bucket("source", "terms", field="source.keyword")
         sr.aggs.bucket("hash_tags", "terms", field="hash_tags.keyword", size=50)
+        return sr
 
-        # execute query
-        response = sr.execute()
+    def get_facets_key(self, params):
+        return json.dumps(dict((key, params[key]) for key in self.FILTERS), sort_keys=True)
+
+    def search(self, params):
+        """
+        this method executes search for results only
+        """
+        return self.format_hits(self.get_hits_search(params).execute(), params["size"])
+
+    def search_with_facets(self, params):
+        """
+        this method executes results and facets searches in one msearch
+        request, facets are cached for other pages of the same filters
+        """
+        ms = MultiSearch(using=es, index="article")
+        ms = ms.add(self.get_hits_search(params)).add(self.get_facets_search(params))
+        hits, facets = ms.execute()
+        facets_cache.set(self.get_facets_key(params), self.format_facets(facets))
+        return self.format_hits(hits, params["size"])
+
+    def get(self, request):
+        params = self.get_params(request)
+        if not params["domain"]:
+            return Response(create_serializer_error_response({"domain": ["Domain id is required"]}))
 
-        results, filters = self.format_response(response)
-        count = response["hits"]["total"]
+        if params["cursor"] is not None:
+            params["page"] = 1
+            if params["cursor"] and self.decode_cursor(params["cursor"]) is None:
+                return Response(create_error_response({"cursor": ["Invalid cursor"]}))
+
+        page = params["page"]
+        size = params["size"]
+        key = json.dumps(dict((key, value) for key, value in params.items() if key != "facets"), sort_keys=True)
+        facets_key = self.get_facets_key(params)
+
+        hits = search_cache.get(key)
+        filters = facets_cache.get(facets_key) if params["facets"] else {}
+        if hits is None and filters is None:
+            hits = search_cache.get_or_set(key, lambda: self.search_with_facets(params))
+            filters = facets_cache.get(facets_key)
+        elif hits is None:
+            hits = search_cache.get_or_set(key, lambda: self.search(params))
+        if filters is None:
+            filters = facets_cache.get_or_set(facets_key, lambda: self.format_facets(self.get_facets_search(params).execute()))
+
+        results, count, next_cursor = hits
+        if not results:
+            filters = {}
         total_pages = math.ceil(count / size)
 
         url = request.build_absolute_uri()
-        if end < count:
+        if params["cursor"] is not None:
+            data = {
+                "results": results,
+                "filters": filters,
+                "count": count,
+                "next": replace_query_param(url, "cursor", next_cursor) if next_cursor else None
+            }
+            return Response(create_response(data))
+
+        if page * size < count:
             next_page = page + 1
             next_url = replace_query_param(url, "page", next_page)
         else:
@@ -985,10 +1139,22 @@ class TrendingArticleAPIView(APIView):
 
     def get(self, request, format=None, *args, **kwargs):
         """
-        List all the trending articles
+        List all the trending articles, served from payload published by
+        generate_trending when available
         """
-        source = TrendingArticleSerializer(TrendingArticle.objects.all(), many=True)
-        return Response(create_response({"results": source.data}))
+        domain = request.GET.get("domain")
+        payload = get_trending_payload(domain)
+        if payload is None:
+            return Response(create_response({"results": get_trending_data(domain)}))
+
+        version, content = payload
+        etag = '"trending-{0}"'.format(version)
+        if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type="application/json")
+        response["ETag"] = etag
+        return response
 
 
 class ArticleCreateUpdateView(APIView):
@@ -1101,17 +1267,23 @@ class GetDailyDigestView(ListAPIView):
 
         return dd.articles.all().order_by("-published_on")
 
+    def get_latest(self):
+        """
+        this method returns top articles served when device has no digest
+        """
+        sort = "desc"
+        sr = Search(using=es, index="article")
+        sr = sr.sort({"article_score" : {"order" : sort}}, {"published_on" : {"order" : sort}})
+        sr = sr[0:20]
+        response = sr.execute()
+        return self.format_response(response)
+
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
 
         if not queryset:
-            sr = Search(using=es, index="article")
-            sort = "desc"
-            sr = sr.sort({"article_score" : {"order" : sort}})
-            sr = sr.sort({"published_on" : {"order" : sort}})
-            sr = sr[0:20]
-            response = sr.execute()
-            results = self.format_response(response)
+            # top articles are the same for every device
+            results = search_cache.get_or_set("daily_digest", self.get_latest)
             return Response(create_response({"results": results}))
 
         serializer = self.get_serializer(queryset, many=True)
@@ -1,16 +1,20 @@
 from __future__ import division
 import numpy
 import datetime
-from news_site.utils import es
+from core.utils import es
 from django.utils import timezone
 
 
 class ArticleScore(object):
     """
     this class is used to calculate custom score for given article
-    based on various parametres
+    based on various parametres, similar articles are looked up in
+    elastic search unless a local RecentArticleIndex is given
     """
 
+    def __init__(self, index=None):
+        self.index = index
+
     def softmax(self, w, t=1.0):
         """
         Calculate the softmax of a list of numbers w.
@@ -40,76 +44,117 @@ class ArticleScore(object):
             score = score + len(doc["images"])
         return score + 1
 
-    def get_diversity_score(self, doc):
+    def get_diversity_query(self, title, start, end):
+        """
+        this method returns query for articles similar to given title
+        """
+        return {
+            "query": {
+                "bool": {
+                    "must": [
+                        { "multi_match": {"query": title, "fields": ["title", "blurb^3"] }},
+                        ],
+                    "filter": [
+                        {"range" : {"published_on" : {"gt": start,"lt": end}}}
+                        ]
+                    }
+                }
+            }
+
+    def get_similar_articles(self, doc):
+        """
+        this method returns articles similar to given article in last 48 hours
+        """
+        start, end = self.get_date_range()
+        return es.search(index='article', body=self.get_diversity_query(doc["title"], start, end))
+
+    def get_similar_articles_batch(self, docs):
+        """
+        this method returns similar articles for every given article
+        using single msearch round trip
+        """
+        if not docs:
+            return []
+        start, end = self.get_date_range()
+        body = []
+        for doc in docs:
+            body.append({"index": "article"})
+            body.append(self.get_diversity_query(doc["title"], start, end))
+        return es.msearch(body=body)["responses"]
+
+    def get_hits(self, results):
+        """
+        this method returns hits of search response, failed msearch
+        responses are treated as no hits
+        """
+        if "error" in results:
+            return []
+        return results["hits"]["hits"]
+
+    def get_diversity_score(self, doc, results=None):
         """
         this method is used to calculate score based on similar article count
         in last 48 hours
         """
         default_score = 23.3
-        title = doc["title"]
-        start, end = self.get_date_range()
-        results = es.search(
-            index='article',
-            body={
-                "query": {
-                    "bool": {
-                        "must": [
-                            { "multi_match": {"query": title, "fields": ["title", "blurb^3"] }},
-                            ],
-                        "filter": [
-                            {"range" : {"published_on" : {"gt": start,"lt": end}}}
-                            ]
-                        }
-                    }
-                }
-            )
+        if results is None:
+            results = self.get_similar_articles(doc)
+        hits = self.get_hits(results)
 
-        if not results["hits"]["hits"]:
+        if not hits:
             return results, default_score
 
+        # hits are sorted by score, so the ones above 80% of max score are
+        # the same as a min_score query would return
         min_query_score = int(results["hits"]["max_score"] * 0.8)
+        similar = [hit for hit in hits if hit["_score"] >= min_query_score]
 
-        new_results = es.search(
-            index='article',
-            body={
-                "min_score": min_query_score,
-                "query": {
-                    "bool": {
-                        "must": [
-                            { "multi_match": {"query": title, "fields": ["title", "blurb^3"] }},
-                            ],
-                        "filter": [
-                            {"range" : {"published_on" : {"gt": start,"lt": end}}}
-                            ]
-                        }
-                    }
-                }
-            )
-
-        if len(new_results["hits"]["hits"]) == 0:
+        if len(similar) == 0:
             return results, default_score
 
-        final_score = default_score * (1 / len(new_results["hits"]["hits"]))
+        final_score = default_score * (1 / len(similar))
 
         return results, round(final_score, 2)
 
-    def get_diversity_uniqueness_score(self, doc):
+    def get_diversity_uniqueness_score(self, doc, results=None):
         """
         this method is used to calculate uniqueness score for given article
         """
         default_score = 23.3
-        results, diversity_score = self.get_diversity_score(doc)
+        results, diversity_score = self.get_diversity_score(doc, results)
+        hits = self.get_hits(results)
 
-        if not results["hits"]["hits"]:
+        if not hits:
             return diversity_score, default_score
 
-        scores_list = [i["_score"] for i in results["hits"]["hits"]]
+        scores_list = [i["_score"] for i in hits]
         softmax_array = list(self.softmax(scores_list))
 
         final_score = default_score * (1 - softmax_array[0])
 
         return diversity_score, round(final_score, 2)
 
+    def get_local_diversity_uniqueness_score(self, doc):
+        """
+        this method is used to calculate diversity and uniqueness score
+        from jaccard similarity of articles in the local index
+        """
+        default_score = 23.3
+        scores = self.index.query(doc["title"], doc.get("blurb"))
+
+        if not scores:
+            return default_score, default_score
+
+        similar = [score for score in scores if score >= scores[0] * 0.8]
+        diversity_score = default_score * (1 / len(similar))
+
+        # jaccard lies in [0, 1], lower temperature gives the softmax
+        # a spread comparable to elastic search scores
+        softmax_array = list(self.softmax(scores, t=0.1))
+        uniqueness_score = default_score * (1 - softmax_array[0])
+
+        return round(diversity_score, 2), round(uniqueness_score, 2)
+
     def get_content_score(self):
         """
         this method is used to calculate score based on article content
@@ -134,13 +179,16 @@ class ArticleScore(object):
 
         return default_score
 
-    def calculate_score(self, doc):
+    def calculate_score(self, doc, results=None):
         """
         this method is used to calculate final article score
         based on
         cover image, diversity, uniqeness, content, performance and bounce score
         """
-        diversity_score, uniqueness_score = self.get_diversity_uniqueness_score(doc)
+        if self.index is not None:
+            diversity_score, uniqueness_score = self.get_local_diversity_uniqueness_score(doc)
+        else:
+            diversity_score, uniqueness_score = self.get_diversity_uniqueness_score(doc, results)
         final_score = sum([
             self.get_cover_image_score(doc),
             diversity_score,
@@ -151,3 +199,13 @@ class ArticleScore(object):
         ])
 
         return round(final_score, 2)
+
+    def calculate_scores(self, docs):
+        """
+        this method is used to calculate final article score for
+        a batch of articles
+        """
+        if self.index is not None:
+            return [self.calculate_score(doc) for doc in docs]
+        responses = self.get_similar_articles_batch(docs)
+        return [self.calculate_score(doc, results) for doc, results in zip(docs, responses)]
@@ -0,0 +1,141 @@
+import json
+import time
+import threading
+
+from cachetools import TTLCache
+from redis import RedisError
+from django.conf import settings
+
+from core.utils import redis_client
+
+
+class ResponseCache(object):
+    """
+    json serializable values cached in redis under prefix with ttl, cache
+    errors are treated as misses so callers fall back to computing value
+    """
+
+    def __init__(self, prefix, ttl):
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get_key(self, key):
+        return "{0}:{1}".format(self.prefix, key)
+
+    def get(self, key):
+        """
+        this method returns cached value or None
+        """
+        try:
+            value = redis_client.get(self.get_key(key))
+        except RedisError:
+            return None
+        if value is None:
+            return None
+        return json.loads(value.decode("utf-8"))
+
+    def set(self, key, value):
+        try:
+            redis_client.set(self.get_key(key), json.dumps(value), ex=self.ttl)
+        except RedisError:
+            pass
+
+    def delete_many(self, keys, chunk_size=1000):
+        """
+        this method removes cached values of given keys
+        """
+        keys = [self.get_key(key) for key in keys]
+        for start in range(0, len(keys), chunk_size):
+            redis_client.delete(*keys[start:start + chunk_size])
+
+
+class VersionedCache(object):
+    """
+    in-process ttl cache which is cleared when generation counter in redis
+    is bumped, the counter is read at most every check_interval seconds,
+    concurrent misses of the same key compute value only once
+    """
+
+    def __init__(self, name, maxsize=1000, ttl=30, check_interval=1):
+        self.generation_key = "{0}:generation".format(name)
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.check_interval = check_interval
+        self.lock = threading.RLock()
+        self.locks = {}
+        self.generation = None
+        self.checked = 0
+
+    def check_generation(self):
+        """
+        this method clears cache when generation has changed since last check
+        """
+        now = time.time()
+        if now - self.checked < self.check_interval:
+            return
+        self.checked = now
+        try:
+            generation = redis_client.get(self.generation_key)
+        except RedisError:
+            return
+        with self.lock:
+            if generation != self.generation:
+                self.cache.clear()
+                self.generation = generation
+
+    def get(self, key):
+        """
+        this method returns cached value of key or None
+        """
+        self.check_generation()
+        with self.lock:
+            return self.cache.get(key)
+
+    def set(self, key, value):
+        with self.lock:
+            self.cache[key] = value
+
+    def get_or_set(self, key, compute):
+        """
+        this method returns cached value of key or stores value returned
+        by compute, callers waiting on the same key reuse that value
+        """
+        self.check_generation()
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+            lock = self.locks.setdefault(key, threading.Lock())
+
+        with lock:
+            with self.lock:
+                if key in self.cache:
+                    return self.cache[key]
+                generation = self.generation
+            try:
+                value = compute()
+                with self.lock:
+                    # value computed before an invalidation is not stored
+                    if generation == self.generation:
+                        self.cache[key] = value
+            finally:
+                with self.lock:
+                    self.locks.pop(key, None)
+        return value
+
+    def invalidate(self):
+        """
+        this method clears cache of every process using this cache
+        """
+        with self.lock:
+            self.cache.clear()
+        try:
+            redis_client.incr(self.generation_key)
+        except RedisError as e:
+            print("error in invalidating {0}".format(self.generation_key))
+            print(e)
+
+
+recommendation_cache = ResponseCache("recommendation", settings.RECOMMENDATION_CACHE_TTL)
+search_cache = VersionedCache("search", settings.SEARCH_CACHE_SIZE, settings.SEARCH_CACHE_TTL)
+# facets share generation of search results so ingestion clears both
+facets_cache = VersionedCache("search", settings.SEARCH_CACHE_SIZE, settings.FACETS_CACHE_TTL)
+category_cache = VersionedCache("categories", 1, settings.CATEGORY_CACHE_TTL)
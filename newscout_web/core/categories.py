@@ -0,0 +1,65 @@
+from collections import defaultdict
+
+from django.db.models.signals import post_save, post_delete
+
+from core.cache import category_cache
+from core.models import Category, CategoryAssociation
+
+
+class CategoryHierarchy(object):
+    """
+    category ids with their transitive child categories, built once from
+    CategoryAssociation so expanding a category filter needs no query
+    """
+
+    def __init__(self, ids, associations):
+        self.ids = set(ids)
+        children = defaultdict(set)
+        for parent, child in associations:
+            children[parent].add(child)
+
+        self.descendants = {}
+        for pk in self.ids:
+            seen = set([pk])
+            pending = [pk]
+            while pending:
+                for child in children[pending.pop()]:
+                    if child not in seen:
+                        seen.add(child)
+                        pending.append(child)
+            self.descendants[pk] = frozenset(seen)
+
+    @classmethod
+    def load(cls):
+        return cls(
+            Category.objects.values_list("id", flat=True),
+            CategoryAssociation.objects.values_list("parent_cat_id", "child_cat_id"))
+
+    def expand(self, ids):
+        """
+        this method returns given category ids which exist together with
+        all of their descendants
+        """
+        categories = set()
+        for pk in ids:
+            pk = int(pk) if str(pk).isdigit() else None
+            if pk in self.ids:
+                categories.update(self.descendants[pk])
+        return categories
+
+
+def get_category_hierarchy():
+    """
+    this function returns hierarchy shared by the process, it is rebuilt
+    after categories or associations change in any process
+    """
+    return category_cache.get_or_set("hierarchy", CategoryHierarchy.load)
+
+
+def on_change(sender, **kwargs):
+    category_cache.invalidate()
+
+
+for model in (Category, CategoryAssociation):
+    post_save.connect(on_change, sender=model, weak=False)
+    post_delete.connect(on_change, sender=model, weak=False)
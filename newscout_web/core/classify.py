@@ -1,5 +1,6 @@
 import re
 import json
+import bisect
 from collections import OrderedDict
 
 
@@ -69,9 +70,45 @@ class RegexClassification(object):
             "168": "[Cc]arbon|[Cc]limate\s[Cc]hange|CO2|polluti(on|ng)"
             })
 
+        self.uncategorised = "123"
+        self.patterns = [(cat, re.compile(pattern)) for cat, pattern in self.regex.items()]
+
     def match(self, title):
-        uncategorised = "123"
-        for cat, pattern in self.regex.items():
-            if re.search(pattern, title):
+        for cat, pattern in self.patterns:
+            if pattern.search(title):
                 return cat
-        return uncategorised
+        return self.uncategorised
+
+    def match_many(self, titles):
+        """
+        classify a batch of titles, every pattern scans all titles which
+        are still unmatched in one call, so earlier categories win just
+        like in match
+        """
+        titles = list(titles)
+        result = [self.uncategorised] * len(titles)
+        pending = list(range(len(titles)))
+        text = None
+        for cat, pattern in self.patterns:
+            if not pending:
+                break
+            if text is None:
+                # titles are joined with NUL which no pattern can match,
+                # so a match never spans two titles
+                offsets = []
+                position = 0
+                for i in pending:
+                    offsets.append(position)
+                    position += len(titles[i]) + 1
+                text = "\x00".join(titles[i] for i in pending)
+
+            matched = set()
+            for current in pattern.finditer(text):
+                matched.add(bisect.bisect_right(offsets, current.start()) - 1)
+
+            if matched:
+                for j in matched:
+                    result[pending[j]] = cat
+                pending = [i for j, i in enumerate(pending) if j not in matched]
+                text = None
+        return result
@@ -0,0 +1,125 @@
+import os
+import time
+import socket
+from collections import Counter
+
+from redis import RedisError
+from django.conf import settings
+
+from core.utils import redis_client
+
+
+MAX_HOURS = 30 * 24
+PREFIX = "heavy_hitters"
+
+
+class SpaceSaving(object):
+    """
+    Space-Saving summary which keeps at most capacity counters, counts of
+    frequent items are overestimated by at most the smallest counter
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+
+    def add(self, item, count=1):
+        if item in self.counts or len(self.counts) < self.capacity:
+            self.counts[item] = self.counts.get(item, 0) + count
+            return
+        # replace the smallest counter, new item inherits its count
+        smallest = min(self.counts, key=self.counts.get)
+        self.counts[item] = self.counts.pop(smallest) + count
+
+    def top(self, size=10):
+        return Counter(self.counts).most_common(size)
+
+    def __len__(self):
+        return len(self.counts)
+
+
+def get_hour(timestamp=None):
+    return int((timestamp or time.time()) // 3600)
+
+
+def get_bucket_key(hour, worker=None):
+    if worker is None:
+        return "{0}:{1}".format(PREFIX, hour)
+    return "{0}:{1}:{2}".format(PREFIX, hour, worker)
+
+
+class HashTagTracker(object):
+    """
+    counts hash tags seen by an ingestion worker in Space-Saving summaries
+    per hour, summaries are written to redis so that buckets of every
+    worker can be merged for any window up to MAX_HOURS
+    """
+
+    def __init__(self, capacity=None, flush_interval=60):
+        self.capacity = capacity or settings.HEAVY_HITTERS_CAPACITY
+        self.flush_interval = flush_interval
+        self.worker = "{0}:{1}".format(socket.gethostname(), os.getpid())
+        self.hour = None
+        self.summary = None
+        self.dirty = False
+        self.last_flush = time.time()
+
+    def add(self, tags):
+        """
+        this method counts given tags in summary of current hour
+        """
+        hour = get_hour()
+        if hour != self.hour:
+            self.flush()
+            self.hour = hour
+            self.summary = SpaceSaving(self.capacity)
+        for tag in tags:
+            self.summary.add(tag)
+            self.dirty = True
+        if time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        this method replaces bucket of this worker for current hour in redis
+        """
+        if not self.dirty:
+            return
+        key = get_bucket_key(self.hour, self.worker)
+        index_key = get_bucket_key(self.hour)
+        ttl = (MAX_HOURS + 1) * 3600
+        try:
+            pipe = redis_client.pipeline()
+            pipe.delete(key)
+            pipe.hmset(key, self.summary.counts)
+            pipe.expire(key, ttl)
+            pipe.sadd(index_key, key)
+            pipe.expire(index_key, ttl)
+            pipe.execute()
+            self.dirty = False
+            self.last_flush = time.time()
+        except RedisError as e:
+            print("error in writing hash tag counts")
+            print(e)
+
+
+def get_top_hash_tags(hours, size=10):
+    """
+    this function returns name and count of size most used hash tags of
+    last given hours, merged from hourly buckets of every worker
+    """
+    hours = max(1, min(hours, MAX_HOURS))
+    current = get_hour()
+    pipe = redis_client.pipeline()
+    for hour in range(current - hours + 1, current + 1):
+        pipe.smembers(get_bucket_key(hour))
+    keys = [key for members in pipe.execute() for key in members]
+
+    counts = Counter()
+    pipe = redis_client.pipeline()
+    for key in keys:
+        pipe.hgetall(key)
+    for bucket in pipe.execute():
+        for name, count in bucket.items():
+            counts[name.decode("utf-8")] += int(count)
+    return [{"name": name, "count": count} for name, count in counts.most_common(size)]
@@ -0,0 +1,34 @@
+from core.models import Article
+from api.v1.serializers import ArticleSerializer
+
+
+def get_article_queryset():
+    """
+    this function returns articles with every relation used by
+    ArticleSerializer prefetched, ordered by id
+    """
+    return Article.objects.select_related("source", "category", "domain").prefetch_related(
+        "articlemedia_set", "hash_tags").order_by("id")
+
+
+def get_article_documents(queryset=None, page_size=1000, scores=None):
+    """
+    this function yields serialized articles of queryset as they are
+    stored in elastic search, articles are read in pages ordered by id,
+    article_score is added for articles present in scores
+    """
+    if queryset is None:
+        queryset = get_article_queryset()
+    scores = scores or {}
+    last_id = 0
+    while True:
+        articles = list(queryset.filter(id__gt=last_id)[:page_size])
+        if not articles:
+            return
+        for article in articles:
+            doc = ArticleSerializer(article, context={"hash_tags_list": True}).data
+            if article.id in scores:
+                doc["article_score"] = scores[article.id]
+            yield doc
+        last_id = articles[-1].id
+        print("Serialized upto article {0}...!!!".format(last_id))
@@ -0,0 +1,44 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from django.core.management.base import BaseCommand
+
+from core.models import Article, HashTagDailyCount
+
+
+class Command(BaseCommand):
+    help = 'This command is used to rebuild per day hash tag counts from articles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', '-d', type=int, help='rebuild counts of last given days [default: since first article]')
+
+    def get_day_range(self, date):
+        start = timezone.make_aware(datetime.datetime.combine(date, datetime.time.min), timezone.utc)
+        return start, start + datetime.timedelta(days=1)
+
+    def handle(self, *args, **options):
+        end_date = timezone.now().date()
+        if options['days'] is not None:
+            start_date = end_date - datetime.timedelta(days=options['days'])
+        else:
+            first = Article.objects.aggregate(first=Min("published_on"))["first"]
+            if first is None:
+                print("No articles found")
+                return
+            start_date = HashTagDailyCount.get_date(first)
+
+        ArticleHashTag = Article.hash_tags.through
+        date = start_date
+        while date <= end_date:
+            start, end = self.get_day_range(date)
+            counts = ArticleHashTag.objects.filter(
+                article__published_on__gte=start, article__published_on__lt=end).values(
+                "hashtag_id").annotate(count=Count("id")).values_list("hashtag_id", "count")
+            rows = [HashTagDailyCount(hash_tag_id=hash_tag_id, date=date, count=count) for hash_tag_id, count in counts]
+            with transaction.atomic():
+                HashTagDailyCount.objects.filter(date=date).delete()
+                HashTagDailyCount.objects.bulk_create(rows, batch_size=1000)
+            print("{0}: {1} hash tags".format(date, len(rows)))
+            date += datetime.timedelta(days=1)
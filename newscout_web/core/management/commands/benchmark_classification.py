@@ -0,0 +1,65 @@
+import re
+import time
+from django.core.management.base import BaseCommand
+
+from core.models import Article
+from core.classify import RegexClassification
+
+
+class Command(BaseCommand):
+    help = 'This command is used to benchmark regex classification against previous implementation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', '-f', type=str, help='file with one title per line, defaults to latest article titles')
+        parser.add_argument('--limit', '-l', type=int, default=10000, help='number of latest article titles to use [default: 10000]')
+        parser.add_argument('--repeat', '-r', type=int, default=3, help='number of timed runs, best one is reported [default: 3]')
+
+    def get_titles(self, path, limit):
+        if path:
+            with open(path) as titles:
+                return [line.strip() for line in titles if line.strip()]
+        return list(Article.objects.order_by("-id").values_list("title", flat=True)[:limit])
+
+    def uncompiled_match(self, classify, title):
+        """
+        previous implementation, relies on re module cache
+        """
+        for cat, pattern in classify.regex.items():
+            if re.search(pattern, title):
+                return cat
+        return "123"
+
+    def timeit(self, func, repeat):
+        best = None
+        result = None
+        for _ in range(repeat):
+            start = time.time()
+            result = func()
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return best, result
+
+    def handle(self, *args, **options):
+        classify = RegexClassification()
+        titles = self.get_titles(options["file"], options["limit"])
+        if not titles:
+            print("No titles found")
+            return
+
+        repeat = options["repeat"]
+        runs = [
+            ("uncompiled", lambda: [self.uncompiled_match(classify, title) for title in titles]),
+            ("match", lambda: [classify.match(title) for title in titles]),
+            ("match_many", lambda: classify.match_many(titles)),
+        ]
+
+        print("Classifying {0} titles, best of {1} runs".format(len(titles), repeat))
+        baseline = None
+        for name, func in runs:
+            elapsed, result = self.timeit(func, repeat)
+            if baseline is None:
+                baseline = result
+            mismatches = sum(1 for a, b in zip(baseline, result) if a != b)
+            print("{0:<12} {1:8.3f}s {2:10.0f} titles/s  mismatches: {3}".format(
+                name, elapsed, len(titles) / elapsed if elapsed else 0, mismatches))
@@ -1,9 +1,12 @@
 import pytz
 import datetime
-from random import randint
+import random
 from operator import itemgetter
-from elasticsearch.helpers import scan
-from core.utils import es, create_index, ingest_to_elastic
+from core.utils import es, scan_docs, create_index, stream_to_elastic
+from core.recommendations import get_tfidf_matrix, get_nearest_neighbours
+from core.cache import recommendation_cache
+from core.models import Article, RelatedArticle
+from django.db import transaction
 from django.utils import timezone
 
 from urllib.parse import urlparse
@@ -17,13 +20,19 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--days', '-d', type=int, default=3, help='Generate recommendations for given days [default: last 3 days]')
+        parser.add_argument('--engine', '-e', type=str, default='tfidf', choices=['tfidf', 'search'], help='tfidf compares articles of the window with each other in one pass, search runs one elastic search query per article [default: tfidf]')
+        parser.add_argument('--size', '-k', type=int, default=25, help='number of recommendations per article [default: 25]')
+        parser.add_argument('--chunk-size', '-c', type=int, default=500, help='articles compared per matrix product in tfidf engine [default: 500]')
+        parser.add_argument('--bulk-size', '-b', type=int, default=500, help='recommendations sent per elastic search bulk request [default: 500]')
+        parser.add_argument('--workers', '-w', type=int, default=1, help='parallel elastic search bulk requests [default: 1]')
+        parser.add_argument('--persist', '-p', action='store_true', help='also store recommendations with scores in RelatedArticle')
 
     def get_recommendations(self, title, size=100, K=25):
         """
-        this method is used to perform title search
+        this method is used to perform title search, returns (id, score)
+        of upto K random hits, newest first
         """
         suggestions = []
-        suggestion_ids = []
 
         results = es.search(
                 index='article',
@@ -37,26 +46,12 @@ class Command(BaseCommand):
                         "size": size
         })
 
-        while len(suggestions) != K:
-            rec = {}
-
-            lucky_number = randint(0, size-1)
-            try:
-                candidate = results['hits']['hits'][lucky_number]
-            except:
-                break
-
-            rec['id'] = candidate['_source']['id']
-
-            if rec['id'] in suggestions:
-                continue
-
-            rec = candidate['_source']['id']
-            ts = candidate['_source']['published_on']
-            suggestions.append((rec, ts))
+        hits = results['hits']['hits']
+        for candidate in random.sample(hits, min(K, len(hits))):
+            suggestions.append((candidate['_source']['id'], candidate['_source']['published_on'], candidate['_score']))
 
         sorted_suggestions = sorted(suggestions, key=itemgetter(1), reverse=True)
-        return [item[0] for item in suggestions]
+        return [(item[0], item[2]) for item in sorted_suggestions]
 
     def get_date_range(self, days=3):
         """
@@ -68,23 +63,79 @@ class Command(BaseCommand):
         end_date = datetime.datetime.combine(end_date, datetime.time.max)
         return start_date.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), end_date.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
 
+    def save_related(self, recommendations):
+        """
+        this method replaces RelatedArticle rows of given source articles,
+        recommendations is list of (article id, [(id, score), ...])
+        """
+        ids = set(source for source, _ in recommendations)
+        ids.update(item for _, neighbours in recommendations for item, _ in neighbours)
+        existing = set(Article.objects.filter(id__in=ids).values_list("id", flat=True))
+
+        rows = []
+        for source, neighbours in recommendations:
+            if source not in existing:
+                continue
+            for item, score in neighbours:
+                if item in existing and item != source:
+                    rows.append(RelatedArticle(source_id=source, related_id=item, score=score))
+
+        with transaction.atomic():
+            RelatedArticle.objects.filter(source_id__in=[source for source, _ in recommendations]).delete()
+            RelatedArticle.objects.bulk_create(rows, batch_size=1000)
+
+    def get_documents(self, articles, options):
+        """
+        this method yields recommendation document of every article, and
+        saves recommendations in chunks when persist option is given
+        """
+        if options['engine'] == 'tfidf':
+            matrix = get_tfidf_matrix(["{0} {1}".format(current['title'], current.get('blurb') or "") for current in articles])
+            recommendations = (
+                (articles[row], [(articles[col]['id'], score) for col, score in neighbours])
+                for row, neighbours in get_nearest_neighbours(matrix, options['size'], options['chunk_size']))
+        else:
+            recommendations = (
+                (current, self.get_recommendations(current['title'], K=options['size']))
+                for current in articles)
+
+        titles = dict((current['id'], current['title']) for current in articles) if self.DEBUG else {}
+        related = []
+        for current, neighbours in recommendations:
+            recommendation = [item for item, _ in neighbours]
+            if self.DEBUG:
+                print(f"Generated Recommendation for: {current['title']}")
+                for item in recommendation:
+                    print("\t", titles.get(item, item))
+            if options['persist']:
+                related.append((current['id'], neighbours))
+                if len(related) >= options['bulk_size']:
+                    self.save_related(related)
+                    related = []
+            yield {"id": current['id'], "recommendation": recommendation}
+
+        if related:
+            self.save_related(related)
+
     def handle(self, *args, **options):
         # make sure we have our recommendations index
         create_index("recommendation")
         days = options['days']
         start, end = self.get_date_range(days)
 
-        results = scan(es, index='article', query={"query": { "range" : { "published_on" : { "gte" : start, "lt" : end}}}, "sort": [{ "published_on" : {"order": "desc"}}]}, preserve_order=True)
-
-        for current in results:
-            article_id, title = current['_source']['id'], current['_source']['title']
-            document = {}
-            document['id'] = article_id
-            document['recommendation'] = self.get_recommendations(title)
-            ingest_to_elastic([document], "recommendation", "recommendation", "id")
-
-            if self.DEBUG:
-                print(f"Generated Recommendation for: {title}")
-
-                for item in document['recommendation']:
-                    print("\t", item['title'])
+        results = scan_docs('article', { "range" : { "published_on" : { "gte" : start, "lt" : end}}}, source=["id", "title", "blurb"], sort=[{ "published_on" : {"order": "desc"}}])
+        articles = list(results)
+        print("Generating recommendations for {0} articles".format(len(articles)))
+
+        indexed, failed = stream_to_elastic(
+            self.get_documents(articles, options), "recommendation", "recommendation", "id",
+            chunk_size=options['bulk_size'], thread_count=options['workers'])
+        print("Generated recommendations for {0} articles, {1} failed".format(indexed, failed))
+
+        # cached responses are dropped only after new recommendations are
+        # written so that a request in between cannot cache old ones again
+        try:
+            recommendation_cache.delete_many([current['id'] for current in articles])
+        except Exception as e:
+            print("error in clearing recommendation cache")
+            print(e)
@@ -1,12 +1,13 @@
-import os
-import string
+import time
 import datetime
 
 from operator import itemgetter
-from datasketch import MinHash
-from core.utils import es
+from datasketch import MinHashLSH
+from core.utils import scan_docs
 from core.models import Article, TrendingArticle
-from django.conf import settings
+from core.similarity import get_tokens, get_min_hash, DisjointSet
+from core.trending import IncrementalTrending, publish_trending, get_trending_rebuild, mark_trending_rebuild
+from django.db import transaction
 from django.utils import timezone
 from django.core.management.base import BaseCommand
 
@@ -14,15 +15,14 @@ from django.core.management.base import BaseCommand
 class Command(BaseCommand):
     help = 'This command is used to generate data for trending section'
 
-    batch = []
     titles = {}
-    stopwords = [current.strip() for current in open(os.path.join(settings.BASE_DIR, "news_site", "management", "commands", "stopwords.txt")).readlines()]
     epoch = 3
     MAX_TRENDING = 30
+    THRESHOLD = 0.2
 
-    def strip_puncs(self, s):
-        table = str.maketrans({key: None for key in string.punctuation})
-        return s.translate(table)
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true', help='keep clusters up to date as articles are ingested instead of rebuilding them, clusters are reloaded when a full rebuild runs')
+        parser.add_argument('--interval', type=int, default=60, help='seconds between checks for new articles in incremental mode [default: 60]')
 
     def get_date_range(self, days=3):
         """
@@ -34,187 +34,171 @@ class Command(BaseCommand):
         end_date = datetime.datetime.combine(end_date, datetime.time.max)
         return start_date.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), end_date.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
 
-    def get_query(self, index, size):
-        start, end = self.get_date_range(self.epoch)
-        return es.search(
-                    index=index,
-                    body={
-                    "query": {
-                        "bool": {
-                            "must": [
-                                {
-                                "term": {"domain": "newscout"}
-                                },
-                                {"range": {
-                                    "published_on": {
-                                        "from": start,
-                                        "to": end
-                                        }
-                                    }
-                                }
-                            ]
-                        }
-                    },
-                    "size": size
-                })
-
-    def get_min_hash(self, title, blurb):
+    def get_docs(self, index):
         """
-        this method generates min hash
+        this method yields articles published in last epoch days
         """
-        signature = MinHash()
-        filter_stopwords = lambda x: x not in self.stopwords
-        contents = self.strip_puncs(title.lower() + " " + blurb.lower()).split()
-        cleaned_contents = set(list(filter(filter_stopwords, contents)))
-
-        for current in cleaned_contents:
-            signature.update(current.encode('utf-8'))
-        return signature
+        start, end = self.get_date_range(self.epoch)
+        query = {
+            "bool": {
+                "must": [
+                    {
+                    "term": {"domain": "newscout"}
+                    },
+                    {"range": {
+                        "published_on": {
+                            "from": start,
+                            "to": end
+                            }
+                        }
+                    }
+                ]
+            }
+        }
+        return scan_docs(index, query, source=["id", "title", "blurb"])
 
-    def has_overlap(self, a, b):
+    def has_overlap(self, a, b, title_tokens):
         """
         this method is used to check if there is overlap of tokens
         between titles
         """
-        filter_stopwords = lambda x: x not in self.stopwords
         for index_a in a:
             for index_b in b:
-                contents_a = self.strip_puncs(self.titles[int(index_a)])
-                contents_b = self.strip_puncs(self.titles[int(index_b)])
+                contents_a = title_tokens[index_a]
+                contents_b = title_tokens[index_b]
 
-                contents_a = set(filter(filter_stopwords, contents_a.lower().split()))
-                contents_b = set(filter(filter_stopwords, contents_b.lower().split()))
-
-                if len(list(contents_a.intersection(contents_b))) != 0:
-                    return (len(list(contents_a.intersection(contents_b))) / float(len(list(contents_a.union(contents_b))))) > 0.10
+                if len(contents_a.intersection(contents_b)) != 0:
+                    return (len(contents_a.intersection(contents_b)) / float(len(contents_a.union(contents_b)))) > 0.10
         return False
 
-    def handle(self, *args, **options):
-        old_objects = TrendingArticle.objects.all()
-        if old_objects:
-            start = old_objects.first().id
-            end = old_objects.last().id
-        index = "article"
-        size = 10
-        response = self.get_query(index, size)
-
-        size = response["hits"]["total"]
+    def publish(self):
+        """
+        this method publishes trending payload served by trending api
+        """
+        try:
+            version = publish_trending()
+            print("Published trending version {0}".format(version))
+        except Exception as e:
+            print("error in publishing trending")
+            print(e)
+
+    def handle_incremental(self, interval):
+        """
+        this method assigns newly ingested articles to trending clusters
+        every interval seconds, clusters are reloaded after a full rebuild
+        or an error
+        """
+        trending = None
+        while True:
+            try:
+                if trending is None or trending.rebuild != get_trending_rebuild():
+                    trending = IncrementalTrending(domain="newscout", days=self.epoch, threshold=self.THRESHOLD)
+                    trending.load()
+                    print("Loaded {0} articles and {1} clusters".format(len(trending.index), len(trending.scores)))
+                    self.publish()
+                else:
+                    removed = trending.expire()
+                    changed = trending.update()
+                    if changed or removed:
+                        print("Updated {0} clusters, removed {1}, {2} active".format(len(changed), removed, len(trending.scores)))
+                        self.publish()
+            except Exception as e:
+                print("error in incremental trending, reloading clusters")
+                print(e)
+                trending = None
+            time.sleep(interval)
 
-        if size > 0:
-            response = self.get_query(index, size)
+    def handle(self, *args, **options):
+        if options['incremental']:
+            self.handle_incremental(options['interval'])
+            return
 
-            for i in response["hits"]["hits"]:
-                self.batch.append(i["_source"])
+        old_ids = list(TrendingArticle.objects.values_list("id", flat=True))
+        index = "article"
 
+        # banded index so that only candidate pairs likely to be above
+        # threshold are compared
         signatures = {}
-
-
-        for current in self.batch:
-            self.titles[current['id']] = current['title']
-            signatures[current['id']] = self.get_min_hash(current['title'], current['blurb'])
-
-        final_scores = {}
-        uniq_ids = []
-        cluster_mappings = {}
-        clusters = []
-
-        for a in signatures:
-            for b in signatures:
-                if a != b:
-                    score = signatures[a].jaccard(signatures[b])
-                    if score > 0.2:
-                        if a not in uniq_ids:
-                            uniq_ids.append(a)
-
-                        if b not in uniq_ids:
-                            uniq_ids.append(b)
-
-                        key = [str(a), str(b)]
-                        key.sort()
-                        key = "\t".join(key)
-                        final_scores[key] = score
-
-        print("Total uniq ids {}".format(len(uniq_ids)))
-
-        for k, v in final_scores.items():
-            a, b = k.split("\t")
-            if a not in cluster_mappings and b not in cluster_mappings:
-                cluster_id = 0
-
-                if len(clusters) > 0:
-                    cluster_id = len(clusters)
-                cluster_mappings[a] = cluster_id
-                cluster_mappings[b] = cluster_id
-                clusters.append([a, b])
-            elif a not in cluster_mappings and b in cluster_mappings:
-                cluster_mappings[a] = cluster_mappings[b]
-                clusters[cluster_mappings[b]].append(a)
-            elif a in cluster_mappings and b not in cluster_mappings:
-                cluster_mappings[b] = cluster_mappings[a]
-                clusters[cluster_mappings[a]].append(b)
-            else:
+        lsh = MinHashLSH(threshold=self.THRESHOLD, num_perm=128)
+        for current in self.get_docs(index):
+            if current['id'] in signatures:
                 continue
+            self.titles[current['id']] = current['title']
+            signature = get_min_hash(get_tokens(current['title'] + " " + (current['blurb'] or "")))
+            signatures[current['id']] = signature
+            lsh.insert(current['id'], signature)
+
+        similar = DisjointSet()
+        for a, signature in signatures.items():
+            for b in lsh.query(signature):
+                if a < b and signature.jaccard(signatures[b]) > self.THRESHOLD:
+                    similar.union(a, b)
+
+        print("Total uniq ids {}".format(len(similar)))
+
+        # final level of clustering, every cluster is merged with at most
+        # one later cluster whose titles overlap so that common tokens can
+        # not chain unrelated stories together, only clusters sharing at
+        # least one title token can overlap
+        clusters = similar.groups()
+        title_tokens = dict((item, get_tokens(self.titles[item])) for group in clusters for item in group)
+        token_clusters = {}
+        for i, group in enumerate(clusters):
+            for token in set().union(*[title_tokens[item] for item in group]):
+                token_clusters.setdefault(token, set()).add(i)
 
-        # final level of clustering
         final_clusters = []
-        processed_clusters = []
-        for i in range(len(clusters)):
-
-            if i in processed_clusters:
+        partnered = set()
+        for i, group in enumerate(clusters):
+            if i in partnered:
                 continue
-
-            matched = False
-            matched_index = 0
-
-            for j in range(i, len(clusters)):
-                if i != j:
-                    matched = self.has_overlap(clusters[i], clusters[j])
-
-                    if matched:
-                        matched_index = j
-                        break
-
-            if not matched:
-                final_clusters.append(clusters[i])
+            candidates = set()
+            for item in group:
+                for token in title_tokens[item]:
+                    candidates.update(token_clusters[token])
+            partner = None
+            for j in sorted(candidates):
+                if j > i and j not in partnered and self.has_overlap(group, clusters[j], title_tokens):
+                    partner = j
+                    break
+            if partner is None:
+                final_clusters.append(list(group))
             else:
-                final_clusters.append(list(set(clusters[i] + clusters[matched_index])))
-                processed_clusters.append(matched_index)
+                partnered.add(partner)
+                final_clusters.append(list(group) + list(clusters[partner]))
+
+        articles = Article.objects.only("id", "published_on").in_bulk(
+            [int(item) for group in final_clusters for item in group])
 
         cluster_id_to_ts = []
         for i, group in enumerate(final_clusters):
-            ts = None
-            for item in group:
-                item_id = int(item)
-                if Article.objects.filter(id=item_id).exists():
-                    member = Article.objects.get(id=item_id)
-                    if ts is None:
-                        ts = member.published_on
-                        continue
-                    if member.published_on < ts:
-                        ts = member.published_on
-            cluster_id_to_ts.append((i, ts))
+            timestamps = [articles[int(item)].published_on for item in group if int(item) in articles]
+            if timestamps:
+                cluster_id_to_ts.append((i, min(timestamps)))
 
         sorted_cluster_id_to_ts = sorted(cluster_id_to_ts, key=itemgetter(1), reverse=True)
 
-        n = 0
-        for item in sorted_cluster_id_to_ts:
-            i, ts = item
-            group = final_clusters[i]
-            print("Cluster {}:".format(i+1))
-            trending = TrendingArticle()
-            trending.save()
-            for item in group:
-                item_id = int(item)
-                print("\t", self.titles[item_id])
-                if Article.objects.filter(id=item_id).exists():
-                    member = Article.objects.get(id=item_id)
-                    trending.articles.add(member)
-                    trending.save()
-            n += 1
-            if n >= self.MAX_TRENDING:
-                break
-
-        print("Removing old trending objects")
-        if old_objects:
-            old_objects_ids = list(range(start, end+1))
-            TrendingArticle.objects.filter(id__in=old_objects_ids).delete()
+        Through = TrendingArticle.articles.through
+        with transaction.atomic():
+            members = []
+            for i, ts in sorted_cluster_id_to_ts[:self.MAX_TRENDING]:
+                group = final_clusters[i]
+                print("Cluster {}:".format(i+1))
+                # scored like incremental clusters so both can be ranked together
+                score = None
+                for item in group:
+                    if int(item) in articles:
+                        score = IncrementalTrending.get_score(score, when=articles[int(item)].published_on)
+                trending = TrendingArticle.objects.create(score=score or 0)
+                for item in group:
+                    item_id = int(item)
+                    print("\t", self.titles[item_id])
+                    if item_id in articles:
+                        members.append(Through(trendingarticle_id=trending.id, article_id=item_id))
+            Through.objects.bulk_create(members)
+
+            print("Removing old trending objects")
+            TrendingArticle.objects.filter(id__in=old_ids).delete()
+
+        mark_trending_rebuild()
+        self.publish()
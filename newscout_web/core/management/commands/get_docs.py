@@ -1,3 +1,4 @@
+import os
 import re
 import sys
 import json
@@ -5,13 +6,12 @@ from django.core.management.base import BaseCommand
 
 from core.models import *
 from api.v1.serializers import ArticleSerializer
-from core.utils import es
+from core.utils import scan_docs
 
 
 class Command(BaseCommand):
     help = 'This command is used to ingest data from database to elastic search'
 
-    batch = []
 
     def add_arguments(self, parser):
         parser.add_argument('--greaterthan', '-g', type=str, help='Date greater than, Date Format: yyyy-mm-dd', required=True)
@@ -25,21 +25,17 @@ class Command(BaseCommand):
             return match.group()
         return None
 
-    def get_query(self, gt, lt, index, size):
-        return es.search(
-                index=index,
-                body={
-                        "query": {
-                            "range" : {
-                                "published_on" : {
-                                    "gt": gt,
-                                    "lt": lt,
-                                    "format": "yyyy-MM-dd"
-                                }
-                            }
-                        },
-                        "size": size
-                    })
+    def get_docs(self, gt, lt, index):
+        query = {
+            "range" : {
+                "published_on" : {
+                    "gt": gt,
+                    "lt": lt,
+                    "format": "yyyy-MM-dd"
+                }
+            }
+        }
+        return scan_docs(index, query)
 
     def handle(self, *args, **options):
         index = "article"
@@ -55,20 +51,20 @@ class Command(BaseCommand):
             print("Invalid less than date")
             sys.exit(1)
 
-        size = 10
-        response = self.get_query(gt, lt, index, size)
+        # docs are written as they are read so the whole date range never
+        # has to be held in memory
+        count = 0
+        with open(output, "w") as out:
+            out.write("[")
+            for doc in self.get_docs(gt, lt, index):
+                if count:
+                    out.write(", ")
+                json.dump(doc, out)
+                count += 1
+            out.write("]")
 
-        size = response["hits"]["total"]
-
-        if size > 0:
-            response = self.get_query(gt, lt, index, size)
-
-            for i in response["hits"]["hits"]:
-                self.batch.append(i["_source"])
-
-        if len(self.batch) > 0:
-            with open(output, "w") as out:
-                json.dump(self.batch, out)
+        if count > 0:
             print ("\nJson data downloaded.\n")
         else:
+            os.remove(output)
             print ("\nNo Data found for given date range.\n")
@@ -4,16 +4,21 @@ import zlib
 import pytz
 import time
 import redis
-import cPickle
+import pickle
 from random import randint
 from datetime import datetime
 from dateutil.parser import parse
+from django.db import transaction
 from django.core.management.base import BaseCommand, CommandError
 
 from core.models import *
 from api.v1.serializers import ArticleSerializer
 from core.utils import create_index, ingest_to_elastic
 from core.classify import RegexClassification
+from core.resolvers import category_resolver, source_resolver, hashtag_resolver
+from core.cache import search_cache
+from core.heavy_hitters import HashTagTracker
+from core.similarity import RecentArticleIndex
 
 from article_scoring import ArticleScore
 
@@ -25,6 +30,9 @@ from prometheus_client import start_http_server, Gauge, Enum
 class Command(BaseCommand):
     help = 'This command is used to ingest data from local disk cache'
 
+    # fields read by batch ingestion, documents missing any are skipped
+    REQUIRED_FIELDS = ("title", "category", "source", "source_url", "cover_image", "blurb", "published_on", "tags", "images")
+
     def __init__(self, *args, **kwargs):
         super(Command, self).__init__(*args, **kwargs)
         self.source_ingest = Gauge("total_ingest_count", "Total number of articles ingested", ['source', 'category'])
@@ -35,6 +43,8 @@ class Command(BaseCommand):
         self.sleep_time = 0
         self.classify = RegexClassification()
         self.score = ArticleScore()
+        self.index = None
+        self.tracker = HashTagTracker()
 
     def reset_stats(self):
         """
@@ -48,6 +58,8 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--source', '-s', type=str, help='redis source name [Ex: theverge]')
         parser.add_argument('--index', '-i', type=str, default='article', help='elastic search index name [default: article]')
+        parser.add_argument('--batch-size', '-b', type=int, default=0, help='number of documents to pull from redis and write in one go, 0 ingests one document at a time [default: 0]')
+        parser.add_argument('--local-scoring', action='store_true', help='score diversity against in-memory index of last 48 hours instead of elastic search')
 
     def get_data_from_redis(self, source):
         """
@@ -55,6 +67,23 @@ class Command(BaseCommand):
         """
         return self.redis.lpop(source)
 
+    def get_batch_from_redis(self, source, size):
+        """
+        this method pops upto size items from redis list in one transaction
+        """
+        pipe = self.redis.pipeline()
+        pipe.lrange(source, 0, size - 1)
+        pipe.ltrim(source, size, -1)
+        items, _ = pipe.execute()
+        return items
+
+    def load_doc(self, file_path):
+        """
+        this method reads pickled document from local disk cache
+        """
+        with open(file_path, "rb") as data:
+            return pickle.loads(zlib.decompress(data.read()))
+
     def parse_date(self, date_str):
         try:
             dt = parse(date_str)
@@ -131,15 +160,17 @@ class Command(BaseCommand):
                 if category == "Uncategorised":
                     # apply regex based category only if article is uncategorised
                     # get category id from regex classfication
-                    category_id = self.classify.match(title)
-                    category = Category.objects.get(id=category_id)
+                    category_id = int(self.classify.match(title))
                 else:
-                    category = Category.objects.get(name=category)
-                source, _ = Source.objects.get_or_create(name=source)
+                    category_id = category_resolver.get(category)
+                category_name = category_resolver.name_of(category_id)
+                if category_name is None:
+                    raise Category.DoesNotExist("Category does not exist: {0}".format(category))
+                source = Source(id=source_resolver.get_or_create(source), name=source)
                 article_obj = Article.objects.create(
                     title=title,
                     source=source,
-                    category=category,
+                    category=Category(id=category_id, name=category_name),
                     source_url=source_url,
                     cover_image=cover_image,
                     blurb=blurb,
@@ -166,21 +197,18 @@ class Command(BaseCommand):
                         )
 
                 if len(tags) > 0:
-                    tag_objs = []
                     new_tags = self.remove_special_chars(tags)
 
                     if new_tags:
-                        for tag in new_tags:
-                            tag_obj = HashTag.objects.filter(name=tag)
-                            if tag_obj:
-                                tag_objs.append(tag_obj.first())
-                            else:
-                                tag_obj = HashTag.objects.create(name=tag)
-                                tag_objs.append(tag_obj)
-                        article_obj.hash_tags.add(*tag_objs)
+                        self.tracker.add(new_tags)
+                        tag_ids = hashtag_resolver.get_or_create_many(new_tags)
+                        article_obj.hash_tags.add(*tag_ids.values())
+                        HashTagDailyCount.increment((tag_id, published_on) for tag_id in tag_ids.values())
 
                 # calculate article score
                 score = self.score.calculate_score(doc)
+                if self.index is not None:
+                    self.index.add(article_obj.pk, title, blurb, published_on)
 
                 serializer = ArticleSerializer(article_obj)
                 json_data = serializer.data
@@ -191,9 +219,167 @@ class Command(BaseCommand):
                 self.batch.append(json_data)
                 if len(self.batch) == 99:
                     ingest_to_elastic(self.batch, index, index, 'id')
+                    search_cache.invalidate()
                     self.batch = []
                     print("Ingesting Batch To Elastic...!!!")
 
+    def create_one_by_one(self, docs, index):
+        """
+        this method creates articles of given documents one at a time,
+        failed documents are reported and skipped
+        """
+        for doc in docs:
+            try:
+                self.create_model_obj(doc, index)
+                self.update_stats(doc)
+            except Exception as e:
+                print("error in doc read")
+                print(e)
+
+    def create_model_objs(self, docs, index):
+        """
+        this method is used to create django article model objects for
+        a batch of documents, lookups are done once for the whole batch
+        and rows are written with bulk inserts
+        """
+        items = []
+        titles = set()
+        for doc in docs:
+            missing = [field for field in self.REQUIRED_FIELDS if field not in doc]
+            if missing or not isinstance(doc["images"], list):
+                print("Skipping invalid document {0}, missing {1}".format(doc.get("source_url"), missing or ["images"]))
+                continue
+            title = doc["title"]
+            full_text = doc.get("short_description") or doc.get("full_text", "")
+            if title and full_text and title not in titles:
+                titles.add(title)
+                items.append((doc, full_text))
+
+        existing = set(Article.objects.filter(title__in=titles).values_list("title", flat=True))
+        items = [(doc, full_text) for doc, full_text in items if doc["title"] not in existing]
+        if not items:
+            return
+
+        # apply regex based category only if article is uncategorised
+        category_names = set()
+        uncategorised = []
+        for doc, _ in items:
+            if doc["category"] == "Uncategorised":
+                uncategorised.append(doc["title"])
+            else:
+                category_names.add(doc["category"])
+        classified = dict(zip(uncategorised, [int(cat) for cat in self.classify.match_many(uncategorised)]))
+        category_ids = category_resolver.get_many(category_names)
+        valid_ids = set(pk for pk in set(classified.values()) if category_resolver.name_of(pk) is not None)
+
+        source_ids = source_resolver.get_or_create_many(set(doc["source"] for doc, _ in items))
+
+        articles = []
+        article_docs = []
+        article_tags = []
+        for doc, full_text in items:
+            if doc["category"] == "Uncategorised":
+                category_id = classified[doc["title"]]
+                if category_id not in valid_ids:
+                    print("Category does not exist: {0}".format(category_id))
+                    continue
+            else:
+                category_id = category_ids.get(doc["category"])
+                if category_id is None:
+                    print("Category does not exist: {0}".format(doc["category"]))
+                    continue
+
+            cover_image = doc["cover_image"]
+            video_data = doc.get("video_data", "")
+            if not cover_image and video_data:
+                cover_image = video_data[0].get("video_image", "")
+            published_on = self.parse_date(doc["published_on"]) or timezone.now()
+
+            articles.append(Article(
+                title=doc["title"],
+                source_id=source_ids[doc["source"]],
+                category_id=category_id,
+                source_url=doc["source_url"],
+                cover_image=cover_image,
+                blurb=doc["blurb"],
+                full_text=full_text,
+                published_on=published_on,
+                active=True
+            ))
+            article_docs.append(doc)
+            article_tags.append(set(self.remove_special_chars(doc["tags"])) if doc["tags"] else set())
+
+        if not articles:
+            return
+
+        tag_ids = hashtag_resolver.get_or_create_many(set().union(*article_tags))
+        for tags in article_tags:
+            self.tracker.add(tags)
+
+        with transaction.atomic():
+            Article.objects.bulk_create(articles)
+            if any(article.pk is None for article in articles):
+                # backends which can not return ids from bulk insert
+                article_ids = dict(Article.objects.filter(title__in=[a.title for a in articles]).values_list("title", "id"))
+                for article in articles:
+                    article.pk = article_ids[article.title]
+
+            media = []
+            ArticleHashTag = Article.hash_tags.through
+            hash_tags = []
+            for article, doc, tags in zip(articles, article_docs, article_tags):
+                images = doc["images"]
+                if len(images) > 1:
+                    for img in images:
+                        media.append(ArticleMedia(article_id=article.pk, category="image", url=img))
+
+                for video_dic in doc.get("video_data", ""):
+                    media.append(ArticleMedia(
+                        article_id=article.pk,
+                        category="video",
+                        url=video_dic.get("video_image", ""),
+                        video_url=video_dic.get("video_url", "")
+                    ))
+
+                for tag in tags:
+                    hash_tags.append(ArticleHashTag(article_id=article.pk, hashtag_id=tag_ids[tag]))
+
+            ArticleMedia.objects.bulk_create(media)
+            ArticleHashTag.objects.bulk_create(hash_tags)
+            HashTagDailyCount.increment(
+                (tag_ids[tag], article.published_on) for article, tags in zip(articles, article_tags) for tag in tags)
+
+        # calculate article score
+        scores = dict(zip([article.pk for article in articles], self.score.calculate_scores(article_docs)))
+        if self.index is not None:
+            for article in articles:
+                self.index.add(article.pk, article.title, article.blurb, article.published_on)
+
+        queryset = Article.objects.filter(id__in=list(scores)).select_related(
+            "source", "category", "domain").prefetch_related("articlemedia_set", "hash_tags")
+        for json_data in ArticleSerializer(queryset, many=True).data:
+            json_data["article_score"] = scores[json_data["id"]]
+            if json_data["hash_tags"]:
+                tag_list = self.get_tags(json_data["hash_tags"])
+                json_data["hash_tags"] = tag_list
+            self.batch.append(json_data)
+
+        if len(self.batch) >= 99:
+            ingest_to_elastic(self.batch, index, index, 'id')
+            search_cache.invalidate()
+            self.batch = []
+            print("Ingesting Batch To Elastic...!!!")
+
+    def update_stats(self, doc):
+        """
+        this method is used to update ingestion count for given document
+        """
+        date = datetime.now(pytz.timezone("Asia/Kolkata")).strftime("%Y-%m-%d")
+        if date != self.now:
+            self.now = date
+            # self.reset_stats()
+        self.source_ingest.labels(source=doc.get("source", "source"), category=doc.get("category", "category")).inc()
+
     def handle(self, *args, **options):
         if options['source'] == None:
            raise CommandError("Option `--source=...` must be specified.")
@@ -203,38 +389,62 @@ class Command(BaseCommand):
 
         source = options['source']
         index = options['index']
+        batch_size = options['batch_size']
         create_index(index)
+        if options['local_scoring']:
+            self.index = RecentArticleIndex()
+            self.index.sync(force=True)
+            self.score = ArticleScore(self.index)
+            print("Loaded {0} recent articles for scoring".format(len(self.index)))
         try:
             while True:
-                file_path = self.get_data_from_redis(source)
-                if file_path:
-                    date = datetime.now(pytz.timezone("Asia/Kolkata")).strftime("%Y-%m-%d")
+                if self.index is not None:
+                    # pick up articles ingested by other workers
+                    self.index.sync()
+                if batch_size:
+                    file_paths = self.get_batch_from_redis(source, batch_size)
+                else:
+                    file_path = self.get_data_from_redis(source)
+                    file_paths = [file_path] if file_path else []
+                if file_paths:
                     self.task_state.state("running")
                     self.sleep_time = 0
-                    if os.path.isfile(file_path):
-                        doc = cPickle.loads(zlib.decompress(open(file_path).read()))
+                    docs = []
+                    for file_path in file_paths:
+                        if os.path.isfile(file_path):
+                            try:
+                                docs.append(self.load_doc(file_path))
+                            except Exception as e:
+                                print("error in loading {0}".format(file_path))
+                                print(e)
+                        else:
+                            msg = "Data file not found: {0}".format(file_path)
+                            print(msg)
+
+                    if batch_size:
                         try:
-                            self.create_model_obj(doc, index)
-                            if date == self.now:
-                                self.source_ingest.labels(source=doc.get("source", "source"), category=doc.get("category", "category")).inc()
-                            else:
-                                self.now = datetime.now(pytz.timezone("Asia/Kolkata")).strftime("%Y-%m-%d")
-                                # self.reset_stats()
-                                self.source_ingest.labels(source=doc.get("source", "source"), category=doc.get("category", "category")).inc()
+                            self.create_model_objs(docs, index)
+                            for doc in docs:
+                                self.update_stats(doc)
                         except Exception as e:
-                            print("error in doc read")
+                            # paths are already removed from redis, retry one
+                            # by one so that a bad document only loses itself,
+                            # articles written by the batch are skipped
+                            print("error in batch read, ingesting documents one by one")
                             print(e)
+                            self.create_one_by_one(docs, index)
                     else:
-                        msg = "Data file not found: {0}".format(file_path)
-                        print(msg)
+                        self.create_one_by_one(docs, index)
                 else:
                     self.task_state.state("waiting")
                     print("Sleeping...!!!")
                     time.sleep(10)
                     self.sleep_time += 10
                     if self.sleep_time >= 60:
+                        self.tracker.flush()
                         if self.batch:
                             ingest_to_elastic(self.batch, index, index, 'id')
+                            search_cache.invalidate()
                             print("Ingesting Final Batch...!!!")
                             self.batch = []
                             self.sleep_time = 0
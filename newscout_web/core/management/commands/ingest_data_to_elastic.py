@@ -1,41 +1,28 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
-from core.models import *
-from api.v1.serializers import ArticleSerializer
+from core.indexing import get_article_documents
 from core.utils import create_index, ingest_to_elastic
 
 
 class Command(BaseCommand):
     help = 'This command is used to ingest data from database to elastic search'
 
-    batch = []
-
     def add_arguments(self, parser):
         parser.add_argument('--index', '-i', type=str, default='article', help='elastic search index name [default: article]')
-
-    def get_tags(self, tags):
-        """
-        this method will return tag name from tags objects
-        """
-        tag_list = []
-        for tag in tags:
-            tag_list.append(tag["name"])
-        return tag_list
+        parser.add_argument('--page-size', '-p', type=int, default=1000,
+                            help='number of articles read from database at a time [default: 1000]')
+        parser.add_argument('--chunk-size', '-c', type=int, default=None,
+                            help='number of articles per bulk request [default: ELASTICSEARCH_BULK setting]')
+        parser.add_argument('--threads', '-t', type=int, default=settings.ELASTICSEARCH_BULK["thread_count"],
+                            help='number of parallel bulk requests [default: ELASTICSEARCH_BULK setting]')
 
     def handle(self, *args, **options):
         print("Ingesting Data from Database\n")
         index = options['index']
         create_index(index)
-        for article in Article.objects.all().iterator():
-            serializer = ArticleSerializer(article)
-            json_data = serializer.data
-            if json_data["hash_tags"]:
-                tag_list = self.get_tags(json_data["hash_tags"])
-                json_data["hash_tags"] = tag_list
-            self.batch.append(json_data)
-            if len(self.batch) == 999:
-                ingest_to_elastic(self.batch, index, index, 'id')
-                self.batch = []
-                print("Ingesting Batch...!!!")
-        ingest_to_elastic(self.batch, index, index, 'id')
-        print("Ingesting Final Batch...!!!")
+        indexed, errors = ingest_to_elastic(
+            get_article_documents(page_size=options['page_size']), index, index, 'id',
+            chunk_size=options['chunk_size'], thread_count=options['threads'],
+            raise_on_error=False)
+        print("Ingested {0} articles, {1} failed".format(indexed, len(errors)))
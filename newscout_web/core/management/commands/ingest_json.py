@@ -4,7 +4,7 @@ import zlib
 import pytz
 import time
 import redis
-import cPickle
+import pickle
 from random import randint
 from datetime import datetime
 from dateutil.parser import parse
@@ -14,6 +14,8 @@ from core.models import *
 from api.v1.serializers import ArticleSerializer
 from core.utils import create_index, ingest_to_elastic
 from core.classify import RegexClassification
+from core.resolvers import category_resolver, source_resolver, hashtag_resolver
+from core.cache import search_cache
 
 
 class Command(BaseCommand):
@@ -108,16 +110,18 @@ class Command(BaseCommand):
                 if category == "Uncategorised":
                     # apply regex based category only if article is uncategorised
                     # get category id from regex classfication
-                    category_id = self.classify.match(title)
-                    category = Category.objects.get(id=category_id)
+                    category_id = int(self.classify.match(title))
+                    category = category_resolver.name_of(category_id)
+                    if category is None:
+                        raise Category.DoesNotExist("Category does not exist: {0}".format(category_id))
                 else:
-                    category, _ = Category.objects.get_or_create(name=category)
-                source, _ = Source.objects.get_or_create(name=source)
+                    category_id = category_resolver.get_or_create(category)
+                source = Source(id=source_resolver.get_or_create(source), name=source)
                 article_obj = Article.objects.create(
                     domain=domain,
                     title=title,
                     source=source,
-                    category=category,
+                    category=Category(id=category_id, name=category),
                     source_url=source_url,
                     cover_image=cover_image,
                     blurb=blurb,
@@ -144,18 +148,12 @@ class Command(BaseCommand):
                         )
 
                 if len(tags) > 0:
-                    tag_objs = []
                     new_tags = self.remove_special_chars(tags)
 
                     if new_tags:
-                        for tag in new_tags:
-                            tag_obj = HashTag.objects.filter(name=tag)
-                            if tag_obj:
-                                tag_objs.append(tag_obj.first())
-                            else:
-                                tag_obj = HashTag.objects.create(name=tag)
-                                tag_objs.append(tag_obj)
-                        article_obj.hash_tags.add(*tag_objs)
+                        tag_ids = hashtag_resolver.get_or_create_many(new_tags)
+                        article_obj.hash_tags.add(*tag_ids.values())
+                        HashTagDailyCount.increment((tag_id, published_on) for tag_id in tag_ids.values())
 
                 serializer = ArticleSerializer(article_obj)
                 json_data = serializer.data
@@ -165,6 +163,7 @@ class Command(BaseCommand):
                 self.batch.append(json_data)
                 if len(self.batch) == 99:
                     ingest_to_elastic(self.batch, index, index, 'id')
+                    search_cache.invalidate()
                     self.batch = []
                     print("Ingesting Batch To Elastic...!!!")
 
@@ -191,7 +190,8 @@ class Command(BaseCommand):
                         if f.endswith(".dat"):
                             file_path = "{0}/{1}".format(root, f)
                             if os.path.isfile(file_path):
-                                doc = cPickle.loads(zlib.decompress(open(file_path).read()))
+                                with open(file_path, "rb") as data:
+                                    doc = pickle.loads(zlib.decompress(data.read()))
                                 try:
                                     self.create_model_obj(doc, index, domain)
                                 except Exception as e:
@@ -202,6 +202,7 @@ class Command(BaseCommand):
 
             if self.batch:
                 ingest_to_elastic(self.batch, index, index, 'id')
+                search_cache.invalidate()
                 print("Ingesting Final Batch...!!!")
                 self.batch = []
         except KeyboardInterrupt:
@@ -9,7 +9,6 @@ import pytz
 import time
 import redis
 import json
-import cPickle
 from random import randint
 from datetime import datetime
 from dateutil.parser import parse
@@ -18,6 +17,7 @@ from core.models import *
 from api.v1.serializers import ArticleSerializer
 from core.utils import create_index, ingest_to_elastic
 from core.classify import RegexClassification
+from core.resolvers import category_resolver, source_resolver, hashtag_resolver
 
 from multiprocessing import Pool
 
@@ -100,15 +100,15 @@ def create_model_obj(doc):
             if category == "":
                 # apply regex based category only if article is uncategorised
                 # get category id from regex classfication
-                category_id = classify.match(title)
-                category = Category.objects.get(id=category_id)
+                category_id = int(classify.match(title))
             else:
-                category = Category.objects.get(id=123)
-            source, _ = Source.objects.get_or_create(name=source)
+                category_id = 123
+            if category_resolver.name_of(category_id) is None:
+                raise Category.DoesNotExist("Category does not exist: {0}".format(category_id))
             article_obj = Article.objects.create(
                 title=title,
-                source=source,
-                category=category,
+                source_id=source_resolver.get_or_create(source),
+                category_id=category_id,
                 source_url=source_url,
                 cover_image=cover_image,
                 blurb=blurb,
@@ -135,18 +135,12 @@ def create_model_obj(doc):
                     )
 
             if len(tags) > 0:
-                tag_objs = []
                 new_tags = remove_special_chars(tags)
 
                 if new_tags:
-                    for tag in new_tags:
-                        tag_obj = HashTag.objects.filter(name=tag)
-                        if tag_obj:
-                            tag_objs.append(tag_obj.first())
-                        else:
-                            tag_obj = HashTag.objects.create(name=tag)
-                            tag_objs.append(tag_obj)
-                    article_obj.hash_tags.add(*tag_objs)
+                    tag_ids = hashtag_resolver.get_or_create_many(new_tags)
+                    article_obj.hash_tags.add(*tag_ids.values())
+                    HashTagDailyCount.increment((tag_id, published_on) for tag_id in tag_ids.values())
 
 def get_input():
     for root, subdirs, files in os.walk("/home/tensor/json_data"):
@@ -0,0 +1,89 @@
+import os
+from collections import defaultdict
+from django.db import transaction
+from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Article
+from core.utils import update_to_elastic
+from core.classify import RegexClassification
+from core.resolvers import category_resolver
+
+
+class Command(BaseCommand):
+    help = 'This command is used to move uncategorised articles to categories matched by regex classification'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index', '-i', type=str, default='article', help='elastic search index name [default: article]')
+        parser.add_argument('--batch-size', '-b', type=int, default=5000, help='number of articles classified per batch [default: 5000]')
+        parser.add_argument('--start-id', '-s', type=int, help='resume after given article id, overrides checkpoint file')
+        parser.add_argument('--checkpoint', '-c', type=str, default='reclassify_uncategorised.checkpoint', help='file used to store last processed article id [default: reclassify_uncategorised.checkpoint]')
+
+    def read_checkpoint(self, path):
+        if os.path.isfile(path):
+            with open(path) as checkpoint:
+                return int(checkpoint.read().strip() or 0)
+        return 0
+
+    def write_checkpoint(self, path, last_id):
+        with open(path, "w") as checkpoint:
+            checkpoint.write(str(last_id))
+
+    def handle(self, *args, **options):
+        index = options['index']
+        batch_size = options['batch_size']
+        checkpoint = options['checkpoint']
+        classify = RegexClassification()
+        uncategorised = int(classify.uncategorised)
+
+        last_id = options['start_id']
+        if last_id is None:
+            last_id = self.read_checkpoint(checkpoint)
+
+        articles = Article.objects.filter(category_id=uncategorised)
+        total = articles.filter(id__gt=last_id).count()
+        print("Reclassifying {0} uncategorised articles after id {1}".format(total, last_id))
+
+        processed = 0
+        changed = 0
+        while True:
+            rows = list(articles.filter(id__gt=last_id).order_by("id").values_list("id", "title")[:batch_size])
+            if not rows:
+                break
+
+            ids = [row[0] for row in rows]
+            titles = [row[1] for row in rows]
+            changes = defaultdict(list)
+            for article_id, cat in zip(ids, classify.match_many(titles)):
+                cat = int(cat)
+                if cat != uncategorised and category_resolver.name_of(cat) is not None:
+                    changes[cat].append(article_id)
+
+            if changes:
+                docs = []
+                for cat, article_ids in changes.items():
+                    name = category_resolver.name_of(cat)
+                    for article_id in article_ids:
+                        docs.append({"id": article_id, "category": name, "category_id": cat})
+
+                # database changes are rolled back when elastic search update
+                # fails so that articles are picked up again on next run,
+                # articles missing from elastic search are skipped
+                try:
+                    with transaction.atomic():
+                        now = timezone.now()
+                        for cat, article_ids in changes.items():
+                            Article.objects.filter(id__in=article_ids).update(category_id=cat, modified_at=now)
+                        update_to_elastic(docs, index, index, 'id', ignore_status=(404,))
+                except Exception as e:
+                    print("error in elastic update")
+                    print(e)
+                    raise CommandError("Stopped after id {0}, rerun to resume".format(last_id))
+                changed += len(docs)
+
+            last_id = ids[-1]
+            self.write_checkpoint(checkpoint, last_id)
+            processed += len(rows)
+            print("Processed {0}/{1}, reclassified {2}, last id {3}".format(processed, total, changed, last_id))
+
+        print("Completed, reclassified {0} of {1} articles".format(changed, processed))
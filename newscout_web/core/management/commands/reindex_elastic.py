@@ -0,0 +1,193 @@
+import re
+import json
+
+from django.utils import timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.cache import search_cache
+from core.indexing import get_article_queryset, get_article_documents
+from core.utils import (es, bulk_es, scan_docs, ingest_to_elastic, delete_from_elastic, get_doc_id,
+                        get_alias_indices, swap_alias)
+
+
+class Command(BaseCommand):
+    help = 'This command is used to rebuild articles of elastic search from database into a new index and switch alias to it'
+
+    MERGE_TIMEOUT = 3600
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alias', '-a', type=str, default='article', help='elastic search alias searched by api [default: article]')
+        parser.add_argument('--mapping', '-m', type=str, default=None,
+                            help='json file with body of new index [default: mappings and analysis of current index]')
+        parser.add_argument('--replicas', '-r', type=int, default=None,
+                            help='replicas of new index once loaded [default: replicas of current index]')
+        parser.add_argument('--max-segments', type=int, default=1, help='segments per shard after force merge [default: 1]')
+        parser.add_argument('--keep', '-k', type=int, default=1, help='number of previous indices kept after switch [default: 1]')
+        parser.add_argument('--page-size', '-p', type=int, default=1000,
+                            help='number of articles read from database at a time [default: 1000]')
+        parser.add_argument('--chunk-size', '-c', type=int, default=None,
+                            help='number of articles per bulk request [default: ELASTICSEARCH_BULK setting]')
+        parser.add_argument('--threads', '-t', type=int, default=settings.ELASTICSEARCH_BULK["thread_count"],
+                            help='number of parallel bulk requests [default: ELASTICSEARCH_BULK setting]')
+
+    def get_index_body(self, live, mapping):
+        """
+        this method returns body of new index from mapping file or from
+        current index, replicas and refresh are disabled while loading
+        """
+        if mapping:
+            with open(mapping) as f:
+                body = json.load(f)
+        elif live:
+            current = live[-1]
+            body = {"mappings": es.indices.get_mapping(index=current)[current]["mappings"]}
+            analysis = es.indices.get_settings(index=current)[current]["settings"]["index"].get("analysis")
+            if analysis:
+                body["settings"] = {"analysis": analysis}
+        else:
+            body = {}
+
+        settings = body.setdefault("settings", {})
+        for key in ("number_of_replicas", "refresh_interval"):
+            settings.get("index", {}).pop(key, None)
+        settings.update({"number_of_replicas": 0, "refresh_interval": "-1"})
+        return body
+
+    def get_restore_settings(self, live, replicas):
+        """
+        this method returns settings applied to new index once it is loaded
+        """
+        settings = {"number_of_replicas": 1, "refresh_interval": "1s"}
+        if live:
+            current = es.indices.get_settings(index=live[-1])[live[-1]]["settings"]["index"]
+            settings["number_of_replicas"] = int(current.get("number_of_replicas", 1))
+            settings["refresh_interval"] = current.get("refresh_interval", "1s")
+        if replicas is not None:
+            settings["number_of_replicas"] = replicas
+        return settings
+
+    def get_scores(self, alias):
+        """
+        this method returns article_score of every article in alias, scores
+        are calculated at ingestion and are not stored in database
+        """
+        scores = {}
+        for doc in scan_docs(alias, {"exists": {"field": "article_score"}}, source=["id", "article_score"]):
+            scores[doc["id"]] = doc["article_score"]
+        return scores
+
+    def get_scores_of(self, ids, indices, size=1000):
+        """
+        this method returns article_score of given articles read from first
+        of indices which has it
+        """
+        scores = {}
+        for index in indices:
+            missing = [pk for pk in ids if pk not in scores]
+            for start in range(0, len(missing), size):
+                response = es.mget(
+                    index=index, body={"ids": [get_doc_id(pk) for pk in missing[start:start + size]]},
+                    _source=["id", "article_score"])
+                for doc in response["docs"]:
+                    if doc.get("found") and "article_score" in doc["_source"]:
+                        scores[doc["_source"]["id"]] = doc["_source"]["article_score"]
+        return scores
+
+    def get_changed(self, since):
+        """
+        this method returns articles created or modified since given time
+        """
+        return get_article_queryset().filter(modified_at__gte=since)
+
+    def catch_up(self, index, alias, since, indices, options, scores=None):
+        """
+        this method copies articles created or modified since given time
+        into index and removes the ones marked as spam meanwhile, scores
+        missing from given scores are read from indices, returns errors
+        """
+        articles = self.get_changed(since)
+        spam = list(articles.filter(spam=True).values_list("id", flat=True))
+        removed, errors = 0, []
+        if spam:
+            removed, errors = delete_from_elastic(
+                ({"id": pk} for pk in spam), index, alias, 'id', raise_on_error=False)
+
+        articles = articles.filter(spam=False)
+        scores = dict(scores or {})
+        ids = [pk for pk in articles.values_list("id", flat=True) if pk not in scores]
+        scores.update(self.get_scores_of(ids, indices))
+        indexed, failed = ingest_to_elastic(
+            get_article_documents(articles, options['page_size'], scores), index, alias, 'id',
+            chunk_size=options['chunk_size'], thread_count=options['threads'],
+            raise_on_error=False)
+        errors.extend(failed)
+        print("Caught up {0} articles, {1} removed, {2} failed".format(indexed, removed, len(errors)))
+        return errors
+
+    def remove_old_indices(self, alias, index, keep):
+        """
+        this method deletes versions of alias older than the newest keep
+        ones which are not in use
+        """
+        pattern = re.compile(r"^{0}_\d{{14}}$".format(re.escape(alias)))
+        versions = sorted(name for name in es.indices.get(index="{0}_*".format(alias)) if pattern.match(name))
+        versions = [name for name in versions if name != index]
+        for name in versions[:max(0, len(versions) - keep)]:
+            es.indices.delete(index=name)
+            print("Deleted Index >>>>>>>>>>> " + name)
+
+    def handle(self, *args, **options):
+        alias = options['alias']
+        live = get_alias_indices(alias) or ([alias] if es.indices.exists(alias) else [])
+        index = "{0}_{1}".format(alias, timezone.now().strftime("%Y%m%d%H%M%S"))
+        if es.indices.exists(index):
+            raise CommandError("Index {0} already exists".format(index))
+
+        restore = self.get_restore_settings(live, options['replicas'])
+        es.indices.create(index=index, body=self.get_index_body(live, options['mapping']))
+        print("Created Index >>>>>>>>>>> " + index)
+
+        started = timezone.now()
+        scores = self.get_scores(alias) if live else {}
+        print("Read scores of {0} articles".format(len(scores)))
+        indexed, errors = ingest_to_elastic(
+            get_article_documents(get_article_queryset().filter(spam=False), options['page_size'], scores),
+            index, alias, 'id', chunk_size=options['chunk_size'], thread_count=options['threads'],
+            raise_on_error=False)
+        print("Ingested {0} articles, {1} failed".format(indexed, len(errors)))
+        if errors:
+            raise CommandError("Index {0} is incomplete, alias {1} is unchanged".format(index, alias))
+
+        # articles written to current index while loading
+        caught_up = timezone.now()
+        if self.catch_up(index, alias, started, [index] + live, options):
+            raise CommandError("Index {0} is incomplete, alias {1} is unchanged".format(index, alias))
+
+        es.indices.put_settings(index=index, body={"index": restore})
+        bulk_es.indices.forcemerge(
+            index=index, max_num_segments=options['max_segments'], request_timeout=self.MERGE_TIMEOUT)
+        es.indices.refresh(index=index)
+        es.cluster.health(index=index, wait_for_status="yellow", request_timeout=self.MERGE_TIMEOUT)
+
+        # a concrete index named alias is deleted by the switch, scores of
+        # articles it received since the catch up are read before that
+        scores = {}
+        if alias in live:
+            ids = list(self.get_changed(caught_up).filter(spam=False).values_list("id", flat=True))
+            scores = self.get_scores_of(ids, [alias])
+            live = []
+
+        swap_alias(alias, index)
+        search_cache.invalidate()
+
+        # articles written to previous index between catch up and switch
+        errors = self.catch_up(index, alias, caught_up, [index] + live, options, scores)
+        es.indices.refresh(index=index)
+        search_cache.invalidate()
+        if errors:
+            raise CommandError("Alias {0} is switched to {1} but {2} articles changed meanwhile failed, "
+                               "previous indices are kept".format(alias, index, len(errors)))
+
+        self.remove_old_indices(alias, index, options['keep'])
+        print("Reindexed {0} into {1}".format(alias, index))
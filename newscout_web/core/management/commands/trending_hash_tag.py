@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
-from core.models import Article, TrendingHashTag
-from django.db.models import Count
+from core.models import TrendingHashTag, HashTagDailyCount
+from core.heavy_hitters import get_top_hash_tags
 from datetime import datetime
 from datetime import timedelta
 import pytz
@@ -11,11 +11,13 @@ class Command(BaseCommand):
     for daily you have to run command: python manage.py trending_hash_tag_monthly 1
     for weekly: python manage.py trending_hash_tag_monthly 7
     for monthly: python manage.py trending_hash_tag_monthly 30
+    for last few hours from ingestion counters: python manage.py trending_hash_tag --hours 6
     """
     help = 'This command used to get hash_tag based on daily, weekly and monthly basis'
 
     def add_arguments(self, parser):
-        parser.add_argument('days', type=int, help='Indicates the number of days')
+        parser.add_argument('days', type=int, nargs='?', default=1, help='Indicates the number of days')
+        parser.add_argument('--hours', type=int, help='use hash tags counted by ingestion workers in last given hours, upto 720')
 
     def handle(self, *args, **kwargs):
         days = kwargs['days']
@@ -25,10 +27,9 @@ class Command(BaseCommand):
         utc = pytz.UTC
         end = end.astimezone(utc)
         start = end - timedelta(days=days)
-        articles = Article.objects.all()
-        hash_tags = articles.filter(published_on__range=(start,end)).values('hash_tags__name').annotate(total=Count('hash_tags')).order_by('-total')[:10]  
+        if kwargs['hours']:
+            hash_tags = get_top_hash_tags(kwargs['hours'])
+        else:
+            hash_tags = HashTagDailyCount.get_top(HashTagDailyCount.get_date(start), HashTagDailyCount.get_date(end))
         TrendingHashTag.objects.all().delete()
-        for tags in hash_tags.iterator():
-            for tag in tags.values():
-                TrendingHashTag.objects.create(name=tag)
-                break
+        TrendingHashTag.objects.bulk_create([TrendingHashTag(name=tag["name"]) for tag in hash_tags])
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.4 on 2026-10-18 05:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='relatedarticle',
+            index=models.Index(fields=['source', '-score'], name='core_relate_source__d552ad_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.4 on 2026-10-18 05:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_relatedarticle_source_score_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HashTagDailyCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('hash_tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.HashTag')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='hashtagdailycount',
+            index=models.Index(fields=['date'], name='core_hashta_date_677a5c_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='hashtagdailycount',
+            unique_together={('hash_tag', 'date')},
+        ),
+    ]
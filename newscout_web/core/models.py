@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 
 import random
+from collections import Counter, defaultdict
 
 from django.db import models
 from django.core.validators import URLValidator
@@ -113,6 +114,63 @@ class TrendingHashTag(models.Model):
         return self.name
 
 
+class HashTagDailyCount(models.Model):
+    """
+    this model stores number of articles published per hash tag per day
+    """
+    hash_tag = models.ForeignKey(HashTag, on_delete=models.CASCADE)
+    date = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("hash_tag", "date")
+        indexes = [
+            models.Index(fields=["date"]),
+        ]
+
+    def __unicode__(self):
+        return "%s - %s - %s" % (self.hash_tag_id, self.date, self.count)
+
+    @classmethod
+    def get_date(cls, published_on):
+        """
+        this method returns utc day of article publish time
+        """
+        if timezone.is_aware(published_on):
+            published_on = published_on.astimezone(timezone.utc)
+        return published_on.date()
+
+    @classmethod
+    def increment(cls, hash_tags):
+        """
+        this method adds one to count of every (hash tag id, published_on)
+        pair, rows are created with one bulk insert and counts are updated
+        with one query per distinct day and increment
+        """
+        counts = Counter((hash_tag_id, cls.get_date(published_on)) for hash_tag_id, published_on in hash_tags)
+        if not counts:
+            return
+        cls.objects.bulk_create([
+            cls(hash_tag_id=hash_tag_id, date=date, count=0) for hash_tag_id, date in counts
+        ], ignore_conflicts=True)
+
+        groups = defaultdict(list)
+        for (hash_tag_id, date), count in counts.items():
+            groups[(date, count)].append(hash_tag_id)
+        for (date, count), hash_tag_ids in groups.items():
+            cls.objects.filter(date=date, hash_tag_id__in=hash_tag_ids).update(count=models.F("count") + count)
+
+    @classmethod
+    def get_top(cls, start, end, size=10):
+        """
+        this method returns name and count of size most used hash tags of
+        articles published between start and end dates
+        """
+        hash_tags = cls.objects.filter(date__range=(start, end)).values("hash_tag__name").annotate(
+            count=models.Sum("count")).order_by("-count")[:size]
+        return [{"name": hash_tag["hash_tag__name"], "count": hash_tag["count"]} for hash_tag in hash_tags]
+
+
 class Article(NewsSiteBaseModel):
     domain = models.ForeignKey(
         Domain, blank=True, null=True, on_delete=models.CASCADE)
@@ -171,6 +229,11 @@ class RelatedArticle(NewsSiteBaseModel):
         Article, related_name="related_article", on_delete=models.CASCADE)
     score = models.FloatField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["source", "-score"]),
+        ]
+
     def __unicode__(self):
         return "%s -> %s" % (self.source, self.related)
 
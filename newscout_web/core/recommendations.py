@@ -0,0 +1,59 @@
+import zlib
+
+import numpy as np
+from scipy import sparse
+
+from core.similarity import get_tokens
+
+
+def get_tfidf_matrix(texts, n_features=2 ** 20):
+    """
+    this function returns l2 normalised tf-idf matrix of given texts,
+    tokens are hashed into n_features columns so no vocabulary is kept
+    """
+    rows = []
+    cols = []
+    for row, text in enumerate(texts):
+        for token in get_tokens(text):
+            rows.append(row)
+            cols.append(zlib.crc32(token.encode("utf-8")) % n_features)
+
+    # get_tokens returns a set so every token counts once per text,
+    # duplicate entries are hash collisions and get summed
+    data = np.ones(len(rows), dtype=np.float32)
+    matrix = sparse.csr_matrix((data, (rows, cols)), shape=(len(texts), n_features), dtype=np.float32)
+    matrix.sum_duplicates()
+
+    df = np.bincount(matrix.indices, minlength=n_features)
+    idf = np.log((1.0 + len(texts)) / (1.0 + df)) + 1.0
+    matrix.data *= idf[matrix.indices].astype(np.float32)
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms).dot(matrix).tocsr().astype(np.float32)
+
+
+def get_nearest_neighbours(matrix, k=25, chunk_size=500):
+    """
+    this function yields (row, [(row, cosine similarity), ...]) with upto k
+    most similar other rows, highest first, similarity is computed for
+    chunk_size rows at a time to bound memory
+    """
+    transposed = matrix.T.tocsc()
+    total = matrix.shape[0]
+    for start in range(0, total, chunk_size):
+        end = min(start + chunk_size, total)
+        scores = matrix[start:end].dot(transposed).toarray()
+        scores[np.arange(end - start), np.arange(start, end)] = 0
+
+        size = min(k, total - 1)
+        if size <= 0:
+            for row in range(start, end):
+                yield row, []
+            continue
+
+        top = np.argpartition(-scores, size - 1, axis=1)[:, :size]
+        for offset, candidates in enumerate(top):
+            candidates = candidates[np.argsort(-scores[offset, candidates])]
+            yield start + offset, [
+                (int(col), float(scores[offset, col])) for col in candidates if scores[offset, col] > 0]
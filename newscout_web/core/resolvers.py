@@ -0,0 +1,104 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
+from core.cache import VersionedCache
+from core.models import Category, Source, HashTag
+
+
+class NameResolver(object):
+    """
+    bounded in-process cache which maps model name to id and back, rows
+    renamed or deleted in any process clear the cache of every process
+    through a redis generation counter, entries also expire after ttl
+    """
+
+    def __init__(self, model, maxsize=10000, ttl=300):
+        self.model = model
+        # every row is cached by name and by id
+        self.cache = VersionedCache("resolver:{0}".format(model._meta.model_name), maxsize * 2, ttl)
+        post_save.connect(self.on_save, sender=model, weak=False)
+        post_delete.connect(self.on_delete, sender=model, weak=False)
+
+    def lookup(self, names):
+        """
+        this method returns name to id mapping from database, the oldest
+        row wins when a name has been stored more than once
+        """
+        rows = self.model.objects.filter(name__in=names).order_by("-id").values_list("name", "id")
+        return dict(rows)
+
+    def remember(self, mapping):
+        for name, pk in mapping.items():
+            self.cache.set(("id", name), pk)
+            self.cache.set(("name", pk), name)
+
+    def get_many(self, names):
+        """
+        this method returns name to id mapping for given names which exist
+        """
+        found = {}
+        missing = set()
+        for name in set(names):
+            pk = self.cache.get(("id", name))
+            if pk is None:
+                missing.add(name)
+            else:
+                found[name] = pk
+        if missing:
+            rows = self.lookup(missing)
+            self.remember(rows)
+            found.update(rows)
+        return found
+
+    def get(self, name):
+        """
+        this method returns id for given name or None
+        """
+        return self.get_many([name]).get(name)
+
+    def get_or_create_many(self, names):
+        """
+        this method returns name to id mapping for given names, rows
+        which are missing are created with a single bulk insert
+        """
+        found = self.get_many(names)
+        new_names = set(names) - set(found)
+        if new_names:
+            self.model.objects.bulk_create([self.model(name=name) for name in new_names])
+            rows = self.lookup(new_names)
+            self.remember(rows)
+            found.update(rows)
+        return found
+
+    def get_or_create(self, name):
+        return self.get_or_create_many([name])[name]
+
+    def name_of(self, pk):
+        """
+        this method returns name for given id or None if row does not exist
+        """
+        if pk is None:
+            return None
+        name = self.cache.get(("name", pk))
+        if name is not None:
+            return name
+        row = self.model.objects.filter(id=pk).values_list("name", flat=True).first()
+        if row is not None:
+            self.remember({row: pk})
+        return row
+
+    def on_save(self, sender, instance, created=False, **kwargs):
+        if created:
+            if self.cache.get(("id", instance.name)) is None:
+                self.remember({instance.name: instance.pk})
+        else:
+            # row may have been renamed
+            self.cache.invalidate()
+
+    def on_delete(self, sender, instance, **kwargs):
+        self.cache.invalidate()
+
+
+category_resolver = NameResolver(Category, settings.RESOLVER_CACHE_SIZE, settings.RESOLVER_CACHE_TTL)
+source_resolver = NameResolver(Source, settings.RESOLVER_CACHE_SIZE, settings.RESOLVER_CACHE_TTL)
+hashtag_resolver = NameResolver(HashTag, settings.RESOLVER_CACHE_SIZE, settings.RESOLVER_CACHE_TTL)
@@ -0,0 +1,170 @@
+import os
+import time
+import heapq
+import string
+import datetime
+import threading
+
+from datasketch import MinHash, MinHashLSH
+from django.conf import settings
+from django.utils import timezone
+
+from core.models import Article
+
+
+STOPWORDS = set(current.strip() for current in open(os.path.join(settings.BASE_DIR, "core", "management", "commands", "stopwords.txt")).readlines())
+PUNCTUATION = str.maketrans({key: None for key in string.punctuation})
+
+
+def get_tokens(text):
+    """
+    this function returns set of lower case tokens without punctuation
+    and stopwords
+    """
+    contents = text.lower().translate(PUNCTUATION).split()
+    return set(token for token in contents if token not in STOPWORDS)
+
+
+def get_min_hash(tokens, num_perm=128):
+    """
+    this function generates min hash for given tokens
+    """
+    signature = MinHash(num_perm=num_perm)
+    for current in tokens:
+        signature.update(current.encode('utf-8'))
+    return signature
+
+
+class RecentArticleIndex(object):
+    """
+    in-memory MinHash LSH index of recently published articles, entries
+    expire by published_on once they fall out of the time window
+    """
+
+    def __init__(self, days=2, threshold=0.2, num_perm=128, sync_interval=60):
+        self.days = days
+        self.num_perm = num_perm
+        self.sync_interval = sync_interval
+        self.lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        self.signatures = {}
+        self.expiry = []
+        self.last_id = 0
+        self.last_sync = 0
+        self.lock = threading.RLock()
+
+    def get_cutoff(self):
+        """
+        this method returns start of the window, same as
+        ArticleScore.get_date_range
+        """
+        start_date = timezone.now().date() - timezone.timedelta(days=self.days)
+        return timezone.make_aware(datetime.datetime.combine(start_date, datetime.time.min), timezone.utc)
+
+    def add(self, key, title, blurb, published_on):
+        """
+        this method adds article to the index
+        """
+        if timezone.is_naive(published_on):
+            published_on = timezone.make_aware(published_on, timezone.utc)
+        if published_on < self.get_cutoff():
+            return
+        signature = get_min_hash(get_tokens("{0} {1}".format(title, blurb or "")), self.num_perm)
+        with self.lock:
+            if key in self.signatures:
+                return
+            self.lsh.insert(key, signature)
+            self.signatures[key] = signature
+            heapq.heappush(self.expiry, (published_on, key))
+
+    def expire(self):
+        """
+        this method removes articles published before the window
+        """
+        cutoff = self.get_cutoff()
+        with self.lock:
+            while self.expiry and self.expiry[0][0] < cutoff:
+                _, key = heapq.heappop(self.expiry)
+                self.lsh.remove(key)
+                del self.signatures[key]
+
+    def sync(self, force=False):
+        """
+        this method loads articles created by other ingestion workers since
+        last sync, first call loads the whole window
+        """
+        if not force and time.time() - self.last_sync < self.sync_interval:
+            return
+        self.last_sync = time.time()
+        self.expire()
+        articles = Article.objects.filter(id__gt=self.last_id, published_on__gte=self.get_cutoff()).order_by("id")
+        for pk, title, blurb, published_on in articles.values_list("id", "title", "blurb", "published_on").iterator():
+            self.add(pk, title, blurb, published_on)
+            self.last_id = pk
+
+    def similar(self, title, blurb, size=10):
+        """
+        this method returns (key, jaccard similarity) of upto size most
+        similar articles in the window, highest first
+        """
+        signature = get_min_hash(get_tokens("{0} {1}".format(title, blurb or "")), self.num_perm)
+        with self.lock:
+            keys = self.lsh.query(signature)
+            matches = [(key, signature.jaccard(self.signatures[key])) for key in keys]
+        return sorted(matches, key=lambda match: match[1], reverse=True)[:size]
+
+    def query(self, title, blurb, size=10):
+        """
+        this method returns jaccard similarity of upto size most similar
+        articles in the window, highest first
+        """
+        return [score for _, score in self.similar(title, blurb, size)]
+
+    def __len__(self):
+        return len(self.signatures)
+
+
+class DisjointSet(object):
+    """
+    union find over hashable items with path compression and union by size
+    """
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def add(self, item):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+
+    def find(self, item):
+        self.add(item)
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a, b):
+        root_a = self.find(a)
+        root_b = self.find(b)
+        if root_a == root_b:
+            return root_a
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+        return root_a
+
+    def groups(self):
+        """
+        this method returns list of members for every set
+        """
+        groups = {}
+        for item in self.parent:
+            groups.setdefault(self.find(item), []).append(item)
+        return list(groups.values())
+
+    def __len__(self):
+        return len(self.parent)
@@ -0,0 +1,249 @@
+import math
+import datetime
+
+from redis import RedisError
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from core.models import Article, TrendingArticle, Domain
+from core.similarity import RecentArticleIndex
+from core.utils import redis_client
+from api.v1.serializers import TrendingArticleSerializer
+from api.v1.exception_handler import create_response
+
+
+MAX_TRENDING = 30
+TRENDING_VERSION_KEY = "trending:version"
+TRENDING_SEQUENCE_KEY = "trending:sequence"
+TRENDING_REBUILD_KEY = "trending:rebuild"
+
+# last payload read from redis per domain, reused while version is unchanged
+payloads = {}
+
+
+def get_trending_queryset(domain=None):
+    """
+    this function returns active trending clusters, highest score first,
+    with every relation used by TrendingArticleSerializer prefetched
+    """
+    articles = Article.objects.select_related("source", "category", "domain").prefetch_related(
+        "articlemedia_set", "hash_tags")
+    trending = TrendingArticle.objects.filter(active=True)
+    if domain:
+        trending = trending.filter(Q(domain__domain_id=domain) | Q(domain__isnull=True))
+    return trending.select_related("domain").prefetch_related(
+        Prefetch("articles", queryset=articles)).order_by("-score", "id")
+
+
+def get_trending_data(domain=None):
+    """
+    this function returns serialized trending clusters for domain
+    """
+    return TrendingArticleSerializer(get_trending_queryset(domain)[:MAX_TRENDING], many=True).data
+
+
+def get_payload_key(version, domain=None):
+    return "trending:{0}:{1}".format(version, domain or "all")
+
+
+def publish_trending():
+    """
+    this function renders trending response of every domain and stores it
+    in redis under a new version, the version key is switched only after
+    all payloads are written
+    """
+    version = redis_client.incr(TRENDING_SEQUENCE_KEY)
+    domains = [None] + list(Domain.objects.exclude(domain_id=None).values_list("domain_id", flat=True).distinct())
+    pipe = redis_client.pipeline()
+    for domain in domains:
+        content = JSONRenderer().render(create_response({"results": get_trending_data(domain)}))
+        pipe.set(get_payload_key(version, domain), content, ex=settings.TRENDING_PAYLOAD_TTL)
+    pipe.set(TRENDING_VERSION_KEY, version)
+    pipe.execute()
+    return version
+
+
+def get_trending_rebuild():
+    """
+    this function returns counter of full rebuilds of trending clusters
+    """
+    return redis_client.get(TRENDING_REBUILD_KEY)
+
+
+def mark_trending_rebuild():
+    """
+    this function tells incremental trending processes to reload clusters
+    after a full rebuild has replaced them
+    """
+    try:
+        redis_client.incr(TRENDING_REBUILD_KEY)
+    except RedisError as e:
+        print("error in marking trending rebuild")
+        print(e)
+
+
+def get_trending_payload(domain=None):
+    """
+    this function returns (version, rendered response) of published
+    trending for domain, None when nothing is published or redis is down
+    """
+    try:
+        version = redis_client.get(TRENDING_VERSION_KEY)
+        if version is None:
+            return None
+        version = int(version)
+        cached = payloads.get(domain)
+        if cached is not None and cached[0] == version:
+            return cached
+        content = redis_client.get(get_payload_key(version, domain))
+    except RedisError:
+        return None
+    if content is None:
+        return None
+    payloads[domain] = (version, content)
+    return payloads[domain]
+
+
+class IncrementalTrending(object):
+    """
+    keeps trending clusters up to date as articles arrive, a new article
+    joins the cluster of its most similar recent article or starts a new
+    cluster with the articles it matches, clusters are removed once their
+    newest article falls out of the time window
+
+    cluster score is log2 of the number of articles added to it, each one
+    decayed with HALF_LIFE hours from the time it was added, it is stored
+    relative to EPOCH so scores of clusters updated at different times can
+    be compared directly, full rebuilds score their clusters the same way
+
+    clusters replaced by a full rebuild are reloaded when the rebuild
+    counter changes, see get_trending_rebuild
+    """
+    HALF_LIFE = 6.0
+    EPOCH = datetime.datetime(2019, 1, 1, tzinfo=timezone.utc)
+
+    def __init__(self, domain="newscout", days=3, threshold=0.2):
+        self.domain = domain
+        self.threshold = threshold
+        self.index = RecentArticleIndex(days=days, threshold=threshold)
+        self.cluster_of = {}
+        self.latest = {}
+        self.scores = {}
+        self.last_id = 0
+        self.rebuild = None
+
+    def get_articles(self):
+        return Article.objects.filter(domain__domain_id=self.domain, published_on__gte=self.index.get_cutoff())
+
+    @classmethod
+    def get_score(cls, score=None, count=1, when=None):
+        """
+        this method returns cluster score after adding count articles at
+        given time, now by default
+        """
+        when = when or timezone.now()
+        added = (when - cls.EPOCH).total_seconds() / 3600.0 / cls.HALF_LIFE + math.log2(count)
+        if score is None:
+            return added
+        high, low = max(score, added), min(score, added)
+        return high + math.log2(1 + 2 ** (low - high))
+
+    def load(self):
+        """
+        this method loads articles of the window and existing clusters
+        """
+        self.rebuild = get_trending_rebuild()
+        rows = self.get_articles().order_by("id").values_list("id", "title", "blurb", "published_on")
+        for pk, title, blurb, published_on in rows.iterator():
+            self.index.add(pk, title, blurb, published_on)
+            self.last_id = pk
+
+        self.scores = dict(TrendingArticle.objects.values_list("id", "score"))
+        members = TrendingArticle.articles.through.objects.values_list(
+            "trendingarticle_id", "article_id", "article__published_on")
+        for trending_id, article_id, published_on in members.iterator():
+            self.cluster_of[article_id] = trending_id
+            if trending_id not in self.latest or self.latest[trending_id] < published_on:
+                self.latest[trending_id] = published_on
+
+    def add(self, pk, title, blurb, published_on):
+        """
+        this method assigns article to a cluster and returns cluster id,
+        None is returned when article is not similar to any recent article
+        """
+        matches = [key for key, score in self.index.similar(title, blurb, size=None) if score > self.threshold]
+        self.index.add(pk, title, blurb, published_on)
+        if not matches:
+            return None
+
+        clustered = [key for key in matches if key in self.cluster_of]
+        with transaction.atomic():
+            trending_id = None
+            if clustered:
+                trending_id = self.cluster_of[clustered[0]]
+                members = [pk]
+                score = self.get_score(self.scores.get(trending_id))
+                if not TrendingArticle.objects.filter(id=trending_id).update(score=score):
+                    # cluster was removed by another process
+                    self.remove(set([trending_id]))
+                    trending_id = None
+            if trending_id is None:
+                members = [pk] + [key for key in matches if key not in self.cluster_of]
+                score = self.get_score(count=len(members))
+                trending_id = TrendingArticle.objects.create(score=score).id
+
+            Through = TrendingArticle.articles.through
+            Through.objects.bulk_create([
+                Through(trendingarticle_id=trending_id, article_id=member) for member in members])
+
+        for member in members:
+            self.cluster_of[member] = trending_id
+        self.scores[trending_id] = score
+        if trending_id not in self.latest or self.latest[trending_id] < published_on:
+            self.latest[trending_id] = published_on
+        return trending_id
+
+    def expire(self):
+        """
+        this method removes clusters whose newest article is older than
+        the window and returns number of clusters removed
+        """
+        cutoff = self.index.get_cutoff()
+        self.index.expire()
+        expired = set(trending_id for trending_id, published_on in self.latest.items() if published_on < cutoff)
+        if not expired:
+            return 0
+
+        TrendingArticle.objects.filter(id__in=expired).delete()
+        self.remove(expired)
+        return len(expired)
+
+    def remove(self, removed):
+        """
+        this method forgets clusters of given ids
+        """
+        for trending_id in removed:
+            self.latest.pop(trending_id, None)
+            self.scores.pop(trending_id, None)
+        self.cluster_of = dict(
+            (article_id, trending_id) for article_id, trending_id in self.cluster_of.items()
+            if trending_id not in removed)
+
+    def update(self):
+        """
+        this method processes articles created since last call and returns
+        ids of clusters which have changed
+        """
+        self.expire()
+        changed = set()
+        rows = self.get_articles().filter(id__gt=self.last_id).order_by("id").values_list(
+            "id", "title", "blurb", "published_on")
+        for pk, title, blurb, published_on in rows.iterator():
+            trending_id = self.add(pk, title, blurb, published_on)
+            if trending_id is not None:
+                changed.add(trending_id)
+            self.last_id = pk
+        return changed
@@ -1,19 +1,76 @@
 import sys
 import json
+import redis
+import itertools
+import threading
 from hashlib import md5
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from django.conf import settings
 from elasticsearch import helpers
 from elasticsearch import Elasticsearch
 
 
-es = Elasticsearch(
-    hosts=[
-        {
-            'host': settings.ELASTIC_SERVER_IP,
-            'port': settings.ELASTIC_SERVER_PORT
-        }
-    ]
-)
+def create_client(**options):
+    """
+    this function returns elastic search client configured by ELASTICSEARCH
+    setting, given options override the setting
+    """
+    config = dict(settings.ELASTICSEARCH, **options)
+    kwargs = {
+        "hosts": config["hosts"],
+        "maxsize": config["maxsize"],
+        "timeout": config["timeout"],
+        "max_retries": config["max_retries"],
+        "retry_on_timeout": config["retry_on_timeout"],
+        "dead_timeout": config["dead_timeout"],
+    }
+    if config["sniff"]:
+        kwargs.update({
+            "sniff_on_start": True,
+            "sniff_on_connection_fail": True,
+            "sniffer_timeout": config["sniffer_timeout"],
+        })
+    return Elasticsearch(**kwargs)
+
+
+class LazyClient(object):
+    """
+    elastic search client which is created on first use, so importing this
+    module opens no connections and forked workers build their own pool
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.client = None
+        self.lock = threading.Lock()
+
+    def get_client(self):
+        if self.client is None:
+            with self.lock:
+                if self.client is None:
+                    self.client = create_client(**self.options)
+        return self.client
+
+    def __getattr__(self, name):
+        return getattr(self.get_client(), name)
+
+
+# api requests and batch jobs use separate connection pools so that bulk
+# writes and scrolls can not take every connection needed by searches
+es = LazyClient()
+bulk_es = LazyClient(timeout=settings.ELASTICSEARCH["bulk_timeout"], maxsize=settings.ELASTICSEARCH["bulk_maxsize"])
+
+redis_client = redis.Redis(host=settings.REDIS_SERVER_IP, port=settings.REDIS_SERVER_PORT)
+
+# threads used by api views to run elastic search calls next to other work
+es_executor = ThreadPoolExecutor(max_workers=settings.ES_EXECUTOR_WORKERS)
+
+def get_doc_id(value):
+    """
+    this function returns elastic search _id used for given item id
+    """
+    return md5(str(value).encode()).hexdigest()
+
 
 def create_index(index, mapping=None):
     """
@@ -53,42 +110,189 @@ def create_mapping_for_index(index, mapping):
     print ("Created Index >>>>>>>>>>> " + index)
 
 
-def ingest_to_elastic(docs, index, item_type, item_id):
-    actions = []
-    for i, item in enumerate(docs):
-        action = {
+def get_alias_indices(alias):
+    """
+    this function returns names of indices behind alias, an empty list
+    when alias does not exist
+    """
+    if not es.indices.exists_alias(name=alias):
+        return []
+    return sorted(es.indices.get_alias(name=alias))
+
+
+def swap_alias(alias, index):
+    """
+    this function atomically points alias to index only, a concrete index
+    named alias is deleted in the same request since they can not coexist
+    """
+    current = get_alias_indices(alias)
+    actions = [{"remove": {"index": old, "alias": alias}} for old in current if old != index]
+    if not current and es.indices.exists(alias):
+        actions.append({"remove_index": {"index": alias}})
+    actions.append({"add": {"index": index, "alias": alias}})
+    es.indices.update_aliases(body={"actions": actions})
+    print("Alias {0} >>>>>>>>>>> {1}".format(alias, index))
+
+
+def scan_docs(index, query, source=None, sort=None, size=500, scroll="5m"):
+    """
+    this function lazily yields _source of documents matching query,
+    documents are read with scroll in pages of given size so memory does
+    not grow with the number of matches
+    """
+    body = {"query": query}
+    if sort:
+        body["sort"] = sort
+    if source is not None:
+        body["_source"] = source
+    for hit in helpers.scan(bulk_es, index=index, query=body, size=size, scroll=scroll, preserve_order=bool(sort)):
+        yield hit["_source"]
+
+
+def iter_chunks(iterable, size):
+    """
+    this function yields lists of upto size items of iterable
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def send_bulk_chunk(actions, options, ignore_status=()):
+    """
+    this function sends actions with streaming bulk and returns number of
+    succeeded actions and errors of failed ones, actions failed with a
+    status in ignore_status count as succeeded
+    """
+    success = 0
+    errors = []
+    for ok, info in helpers.streaming_bulk(bulk_es, actions, **options):
+        if ok or list(info.values())[0].get("status") in ignore_status:
+            success += 1
+        else:
+            errors.append(info)
+    return success, errors
+
+
+def bulk_to_elastic(actions, chunk_size=None, max_chunk_bytes=None, thread_count=1, ignore_status=(),
+                    raise_on_error=True, **kwargs):
+    """
+    this function sends actions, which may be a generator, to elastic search
+    in requests of at most chunk_size actions and max_chunk_bytes bytes,
+    thread_count chunks are sent at a time and failures are reported per
+    chunk of chunk_size actions, actions rejected with 429 are
+    retried with exponential backoff, failures with a status in
+    ignore_status are skipped, other failures raise BulkIndexError once all
+    actions are sent or are returned when raise_on_error is False, returns
+    number of succeeded actions and list of errors
+    """
+    config = settings.ELASTICSEARCH_BULK
+    chunk_size = chunk_size or config["chunk_size"]
+    thread_count = thread_count or 1
+    options = {
+        "chunk_size": chunk_size,
+        "max_chunk_bytes": max_chunk_bytes or config["max_chunk_bytes"],
+        "max_retries": config["max_retries"],
+        "initial_backoff": config["initial_backoff"],
+        "max_backoff": config["max_backoff"],
+        "raise_on_error": False,
+        "raise_on_exception": False,
+    }
+    options.update(kwargs)
+
+    success = 0
+    errors = []
+
+    def report(number, chunk_success, chunk_errors):
+        nonlocal success
+        success += chunk_success
+        errors.extend(chunk_errors)
+        if chunk_errors:
+            print("chunk {0}: {1} failed, last error {2}".format(number, len(chunk_errors), chunk_errors[-1]))
+
+    chunks = enumerate(iter_chunks(actions, chunk_size), 1)
+    if thread_count == 1:
+        for number, chunk in chunks:
+            report(number, *send_bulk_chunk(chunk, options, ignore_status))
+    else:
+        # parallel_bulk does not retry rejected actions, so every thread
+        # runs streaming_bulk on its own chunk, pending chunks are bounded
+        # so that a generator is not read faster than it is indexed
+        with ThreadPoolExecutor(thread_count) as executor:
+            pending = {}
+            for number, chunk in chunks:
+                pending[executor.submit(send_bulk_chunk, chunk, options, ignore_status)] = number
+                if len(pending) >= thread_count * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        report(pending.pop(future), *future.result())
+            for future in sorted(pending, key=pending.get):
+                report(pending[future], *future.result())
+
+    if errors and raise_on_error:
+        raise helpers.BulkIndexError("{0} document(s) failed to index.".format(len(errors)), errors)
+    return success, errors
+
+
+def ingest_to_elastic(docs, index, item_type, item_id, **kwargs):
+    """
+    this function indexes docs, which may be a generator, and returns
+    number of indexed docs and errors of failed ones, see bulk_to_elastic
+    """
+    actions = (
+        {
             "_index": index,
             "_type": item_type,
-            "_id": md5(str(item[item_id]).encode()).hexdigest(),
+            "_id": get_doc_id(item[item_id]),
             "_source": item
-        }
-        actions.append(action)
-    helpers.bulk(es, actions, chunk_size=100, request_timeout=20)
+        } for item in docs
+    )
+    return bulk_to_elastic(actions, **kwargs)
 
 
-def update_to_elastic(docs, index, item_type, item_id):
-    actions = []
-    for i, item in enumerate(docs):
-        action = {
+def update_to_elastic(docs, index, item_type, item_id, **kwargs):
+    """
+    this function partially updates documents of docs, which may be a
+    generator, and returns number of updated docs and errors of failed ones
+    """
+    actions = (
+        {
             "_op_type": "update",
             "_index": index,
             "_type": item_type,
-            "_id": md5(str(item[item_id]).encode()).hexdigest(),
+            "_id": get_doc_id(item[item_id]),
             "doc": item
-        }
-        actions.append(action)
-    helpers.bulk(es, actions, chunk_size=100, request_timeout=20)
+        } for item in docs
+    )
+    return bulk_to_elastic(actions, **kwargs)
 
 
-def delete_from_elastic(docs, index, item_type, item_id):
-    actions = []
-    for i, item in enumerate(docs):
-        action = {
+def delete_from_elastic(docs, index, item_type, item_id, **kwargs):
+    """
+    this function deletes documents of docs, which may be a generator, and
+    returns number of deleted docs and errors of failed ones, documents
+    which are already missing are not reported as errors
+    """
+    actions = (
+        {
             "_op_type": "delete",
             "_index": index,
             "_type": item_type,
-            "_id": md5(str(item[item_id]).encode()).hexdigest(),
-            "doc": item
-        }
-        actions.append(action)
-    helpers.bulk(es, actions, index=index, refresh=True)
+            "_id": get_doc_id(item[item_id]),
+        } for item in docs
+    )
+    kwargs.setdefault("refresh", True)
+    return bulk_to_elastic(actions, ignore_status=(404,), **kwargs)
+
+
+def stream_to_elastic(docs, index, item_type, item_id, chunk_size=500, thread_count=1):
+    """
+    this function indexes docs, which may be a generator, and returns total
+    number of indexed and failed documents
+    """
+    indexed, errors = ingest_to_elastic(
+        docs, index, item_type, item_id, chunk_size=chunk_size, thread_count=thread_count, raise_on_error=False)
+    return indexed, len(errors)
@@ -170,3 +170,70 @@ EMAIL_TIMEOUT = None
 
 ELASTIC_SERVER_IP="localhost"
 ELASTIC_SERVER_PORT="9200"
+
+# elastic search clients of core.utils, timeout and maxsize are used by api
+# searches, bulk_timeout and bulk_maxsize by bulk writes and scrolls, dead
+# nodes are retried after dead_timeout seconds doubling on every failure
+ELASTICSEARCH = {
+    "hosts": [
+        {"host": ELASTIC_SERVER_IP, "port": ELASTIC_SERVER_PORT},
+    ],
+    "maxsize": 25,
+    "timeout": 10,
+    "bulk_maxsize": 10,
+    "bulk_timeout": 120,
+    "max_retries": 3,
+    "retry_on_timeout": True,
+    "dead_timeout": 60,
+    "sniff": False,
+    "sniffer_timeout": 60,
+}
+
+# bulk requests of core.utils.bulk_to_elastic, a request holds at most
+# chunk_size actions and max_chunk_bytes bytes, actions rejected with 429
+# are retried max_retries times waiting initial_backoff seconds doubling
+# upto max_backoff, thread_count is the default of bulk indexing commands,
+# other writes send one request at a time
+ELASTICSEARCH_BULK = {
+    "chunk_size": 500,
+    "max_chunk_bytes": 10 * 1024 * 1024,
+    "thread_count": 4,
+    "max_retries": 5,
+    "initial_backoff": 2,
+    "max_backoff": 60,
+}
+
+REDIS_SERVER_IP = "localhost"
+REDIS_SERVER_PORT = 6379
+
+# maximum entries and seconds an entry is kept in in-process name to id
+# caches used by ingestion, renames and deletes clear them right away
+RESOLVER_CACHE_SIZE = 10000
+RESOLVER_CACHE_TTL = 300
+
+# seconds a published trending payload is kept in redis
+TRENDING_PAYLOAD_TTL = 2 * 24 * 60 * 60
+
+# seconds assembled recommendations of an article are cached
+RECOMMENDATION_CACHE_TTL = 60 * 60
+
+# "elastic" serves recommendations from the recommendation index and falls
+# back to RelatedArticle when elastic search fails, "database" always reads
+# RelatedArticle which is filled by generate_recommendations --persist
+RECOMMENDATION_BACKEND = "elastic"
+
+# counters kept per hour by every ingestion worker for trending hash tags
+HEAVY_HITTERS_CAPACITY = 200
+
+# in-process search result cache, cleared by ingestion on every flush
+SEARCH_CACHE_SIZE = 1000
+SEARCH_CACHE_TTL = 30
+FACETS_CACHE_TTL = 60
+
+# seconds category hierarchy used by search is kept before it is rebuilt
+CATEGORY_CACHE_TTL = 5 * 60
+
+# threads per process running elastic search calls of api views, and
+# seconds a view waits for elastic search before answering from database
+ES_EXECUTOR_WORKERS = 10
+ES_HEDGE_TIMEOUT = 0.5